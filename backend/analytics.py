@@ -0,0 +1,161 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy import func, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Query, QueryRollup
+
+#hourly aggregates of the queries table, so dashboards never scan the live table
+
+LOOKBACK_HOURS = 24 #recent hours are recomputed on every run, late rows and feedback clicks still change them
+ROLLUP_LOCK_ID = 7243001 #postgres advisory lock, only one worker rolls up at a time
+BACKFILL_WINDOW = timedelta(days=1) #hours aggregated per statement and transaction, so a first run over a big
+#queries table backfills day by day instead of in one statement the engine wide statement_timeout would cancel
+ROLLUP_COLUMNS = ["hour", "count", "successes", "p50_latency_ms", "p95_latency_ms", "p99_latency_ms", "thumbs_up", "thumbs_down"]
+
+def _utc(value):
+    #sqlite returns naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _hour(value):
+    return _utc(value).astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+def _start_hour(now):
+    #resume from the last rolled up hour, but never later than the lookback window
+    latest = db.session.query(func.max(QueryRollup.hour)).scalar()
+    if latest is not None:
+        return min(_hour(latest), _hour(now) - timedelta(hours=LOOKBACK_HOURS))
+    first = db.session.query(func.min(Query.asked_at)).scalar()
+    return _hour(first) if first is not None else None
+
+def _postgres_rollup(start, end=None):
+    #one INSERT ... SELECT ... GROUP BY hour ... ON CONFLICT, the aggregation runs entirely in postgres
+    hour = func.date_trunc("hour", Query.asked_at, "UTC")
+    latency = Query.latency_ms
+    aggregate = (
+        select(
+            hour,
+            func.count(),
+            func.count().filter(Query.success.is_(True)),
+            func.percentile_cont(0.5).within_group(latency),
+            func.percentile_cont(0.95).within_group(latency),
+            func.percentile_cont(0.99).within_group(latency),
+            func.count().filter(Query.thumbs_up.is_(True)),
+            func.count().filter(Query.thumbs_down.is_(True)),
+        )
+        .where(Query.asked_at >= start, *([Query.asked_at < end] if end is not None else []))
+        .group_by(literal_column("1")) #by position: with server side binding a repeated date_trunc(...) would not match
+    )
+    stmt = pg_insert(QueryRollup).from_select(ROLLUP_COLUMNS, aggregate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[QueryRollup.hour],
+        set_={**{name: stmt.excluded[name] for name in ROLLUP_COLUMNS[1:]}, "updated_at": func.now()},
+    )
+    return db.session.execute(stmt).rowcount
+
+def _python_rollup(start, end=None):
+    #sqlite has no percentile_cont: aggregate in python (development only)
+    rows = db.session.execute(
+        select(Query.asked_at, Query.success, Query.latency_ms, Query.thumbs_up, Query.thumbs_down)
+        .where(Query.asked_at >= start, *([Query.asked_at < end] if end is not None else []))
+    )
+    hours = defaultdict(list)
+    for row in rows:
+        hours[_hour(row.asked_at)].append(row)
+
+    now = datetime.now(timezone.utc)
+    for hour, group in hours.items():
+        latencies = np.array([row.latency_ms for row in group if row.latency_ms is not None], dtype=np.float64)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (None, None, None)
+        values = {
+            "hour": hour,
+            "count": len(group),
+            "successes": sum(1 for row in group if row.success),
+            "p50_latency_ms": None if p50 is None else float(p50),
+            "p95_latency_ms": None if p95 is None else float(p95),
+            "p99_latency_ms": None if p99 is None else float(p99),
+            "thumbs_up": sum(1 for row in group if row.thumbs_up),
+            "thumbs_down": sum(1 for row in group if row.thumbs_down),
+            "updated_at": now,
+        }
+        stmt = sqlite_insert(QueryRollup).values(**values)
+        stmt = stmt.on_conflict_do_update(index_elements=[QueryRollup.hour], set_={k: v for k, v in values.items() if k != "hour"})
+        db.session.execute(stmt)
+    return len(hours)
+
+def _lock():
+    return db.session.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": ROLLUP_LOCK_ID}).scalar()
+
+def rollup_queries(app, now=None):
+    """Recompute the hourly rollups from the last rolled up hour (or the lookback window) to now; returns hours written."""
+    now = now or datetime.now(timezone.utc)
+    written = 0
+    with app.app_context():
+        postgres = db.engine.dialect.name == "postgresql"
+        if postgres and not _lock():
+            db.session.rollback()
+            return 0 #another worker is rolling up right now
+
+        start = _start_hour(now)
+        if start is None:
+            db.session.rollback()
+            return 0
+        rollup = _postgres_rollup if postgres else _python_rollup
+        while True:
+            #windows are whole hours, so no hour is split between two statements; the last one is open ended
+            end = start + BACKFILL_WINDOW
+            if end > _hour(now):
+                end = None
+            written += rollup(start, end)
+            #committed per window, a backfill cut short resumes from the last rolled up hour next run
+            db.session.commit()
+            if end is None:
+                return written
+            start = end
+            if postgres and not _lock():
+                db.session.rollback()
+                return written #lost with the commit, someone else takes over
+
+def start_rollup_thread(app, interval):
+    #every worker may start one, the advisory lock keeps runs from overlapping
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                rollup_queries(app)
+            except Exception as e:
+                app.logger.error(f"Error rolling up queries: {e}")
+
+    threading.Thread(target=run, name="query-rollup", daemon=True).start()
+    return stop
+
+def hourly_rollups(start, end):
+    #reads only the rollup table
+    rows = (
+        QueryRollup.query
+        .filter(QueryRollup.hour >= start, QueryRollup.hour < end)
+        .order_by(QueryRollup.hour)
+        .all()
+    )
+    return [
+        {
+            "hour": _utc(row.hour).isoformat(),
+            "count": row.count,
+            "successRate": round(row.successes / row.count, 4) if row.count else None,
+            "p50LatencyMs": row.p50_latency_ms,
+            "p95LatencyMs": row.p95_latency_ms,
+            "p99LatencyMs": row.p99_latency_ms,
+            "thumbsUp": row.thumbs_up,
+            "thumbsDown": row.thumbs_down,
+        }
+        for row in rows
+    ]
+
+if __name__ == "__main__":
+    #python analytics.py, for a one-off run or a cron job when ROLLUP_INTERVAL is 0
+    from app import app
+    hours = rollup_queries(app)
+    print(f"Rolled up {hours} hours")
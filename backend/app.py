@@ -5,13 +5,14 @@ import os
 from db import db, init_db
 from routes import bp
 from flask_swagger_ui import get_swaggerui_blueprint
-from models import Query, CVUpload
-
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+from models import Query, CVUpload, ChatSession, QueryRollup
+from analytics import start_rollup_thread
+from partitions import start_partition_thread
+from upload_buffer import UploadRequest
 
 load_dotenv()
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 SWAGGER_URL = "/apidocs"       
 API_URL = "/swagger.yaml"   
@@ -33,19 +34,68 @@ def clean_env(key: str) -> str:
     return os.getenv(key, "").strip()
 
 app.config['SQLALCHEMY_DATABASE_URI'] = clean_env('DATABASE_URL')
+app.config['DB_POOL_SIZE'] = int(clean_env('DB_POOL_SIZE') or 5) #connections kept open per worker
+app.config['DB_MAX_OVERFLOW'] = int(clean_env('DB_MAX_OVERFLOW') or 5) #extra connections under bursts
+app.config['DB_POOL_TIMEOUT'] = int(clean_env('DB_POOL_TIMEOUT') or 10) #seconds to wait for a free connection
+app.config['DB_POOL_RECYCLE'] = int(clean_env('DB_POOL_RECYCLE') or 1800) #seconds before a connection is replaced
+app.config['DB_POOL_PRE_PING'] = (clean_env('DB_POOL_PRE_PING') or 'true').lower() == 'true'
+app.config['DB_CONNECT_TIMEOUT'] = int(clean_env('DB_CONNECT_TIMEOUT') or 5) #seconds
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(clean_env('DB_STATEMENT_TIMEOUT_MS') or 15000)
+app.config['DB_PREPARE_THRESHOLD'] = int(clean_env('DB_PREPARE_THRESHOLD') or 5) or None #psycopg 3 only, 0 disables prepared statements
 app.config['CV_BUILDER_API_KEY'] = clean_env('CV_BUILDER_API_KEY')
 app.config['SOP_BUILDER_API_KEY'] = clean_env('SOP_BUILDER_API_KEY')
 app.config['SCHOLARSHIP_FINDER_API_KEY'] = clean_env('SCHOLARSHIP_FINDER_API_KEY')
 app.config['CHATBOT_API_KEY'] = clean_env('CHATBOT_API_KEY')
 app.config['TEST_API_KEY'] = clean_env('TEST_API_KEY')
 app.config['CONTENT_FILE'] = clean_env('CONTENT_FILE')
+app.config['CONTENT_RELOAD_INTERVAL'] = int(clean_env('CONTENT_RELOAD_INTERVAL') or 30) #seconds between checks for a changed content file, 0 disables
+app.config['ANSWER_CACHE_SIZE'] = int(clean_env('ANSWER_CACHE_SIZE') or 1024)
+app.config['ANSWER_CACHE_TTL'] = int(clean_env('ANSWER_CACHE_TTL') or 3600) #seconds
+app.config['ANSWER_CACHE_THRESHOLD'] = float(clean_env('ANSWER_CACHE_THRESHOLD') or 92) #rapidfuzz score, 0-100
+app.config['SESSION_STORE'] = clean_env('SESSION_STORE') or 'memory' #memory (per worker) or database (shared)
+app.config['SESSION_MAX_ENTRIES'] = int(clean_env('SESSION_MAX_ENTRIES') or 10000) #memory store only
+app.config['SESSION_TTL'] = int(clean_env('SESSION_TTL') or 86400) #seconds
+app.config['PROMPT_TOKEN_BUDGET'] = int(clean_env('PROMPT_TOKEN_BUDGET') or 4000) #estimated tokens per /ask prompt
+app.config['QUERY_LOG_BATCH_SIZE'] = int(clean_env('QUERY_LOG_BATCH_SIZE') or 100) #rows per insert
+app.config['QUERY_LOG_FLUSH_MS'] = int(clean_env('QUERY_LOG_FLUSH_MS') or 200) #max wait before a partial batch is written
+app.config['QUERY_LOG_QUEUE_SIZE'] = int(clean_env('QUERY_LOG_QUEUE_SIZE') or 10000) #buffered rows before new ones are dropped
+app.config['QUERY_LOG_ID_BLOCK'] = int(clean_env('QUERY_LOG_ID_BLOCK') or 100) #messageIds reserved per sequence round trip
+app.config['FEEDBACK_RETRY_MS'] = int(clean_env('FEEDBACK_RETRY_MS') or 2000) #feedback for a messageId whose row is not written yet (another worker's query log) is retried this long before 404
+app.config['ROLLUP_INTERVAL'] = int(clean_env('ROLLUP_INTERVAL') or 300) #seconds between hourly analytics rollups, 0 disables
+app.config['QUERY_PARTITION_INTERVAL'] = int(clean_env('QUERY_PARTITION_INTERVAL') or 3600) #seconds between partition maintenance runs, 0 disables
+app.config['QUERY_PARTITION_MONTHS_AHEAD'] = int(clean_env('QUERY_PARTITION_MONTHS_AHEAD') or 2) #monthly partitions created ahead of time
+app.config['QUERY_ARCHIVE_DIR'] = clean_env('QUERY_ARCHIVE_DIR') #old partitions are exported here and detached, empty disables archiving
+app.config['QUERY_ARCHIVE_AFTER_MONTHS'] = int(clean_env('QUERY_ARCHIVE_AFTER_MONTHS') or 12)
+app.config['QUERY_ARCHIVE_FORMAT'] = clean_env('QUERY_ARCHIVE_FORMAT') or 'ndjson' #ndjson (gzipped) or parquet (needs pyarrow)
+app.config['UPLOAD_SPOOL_BYTES'] = int(clean_env('UPLOAD_SPOOL_BYTES') or 1024 * 1024) #uploads above this spill from memory to a temp file
+app.config['CV_UPLOAD_MAX_BYTES'] = int(clean_env('CV_UPLOAD_MAX_BYTES') or 5 * 1024 * 1024) #larger /upload-cv requests are refused with 413
+app.config['CV_UPLOAD_MAX_PAGES'] = int(clean_env('CV_UPLOAD_MAX_PAGES') or 10) #longer pdfs are refused with 413
+app.config['PDF_ENGINE'] = clean_env('PDF_ENGINE') or 'pdfium' #pdfium (fast, falls back to pdfplumber on odd layouts) or pdfplumber
+app.config['PDF_PARALLEL_PAGES'] = int(clean_env('PDF_PARALLEL_PAGES') or 0) #pdfs with this many pages or more are extracted in worker processes, 0 disables;
+#only worth setting when CV_UPLOAD_MAX_PAGES is raised far beyond cv length, pdfium reads a 10 page cv in ~10ms and a pool costs more
+app.config['FAQ_THRESHOLD'] = float(clean_env('FAQ_THRESHOLD') or 88) #rapidfuzz score needed to answer from the corpus faqs
+app.config['CLASSIFIER_MODEL'] = clean_env('CLASSIFIER_MODEL') #optional off-topic model from python -m chatbot.classifier
+app.config['CLASSIFIER_THRESHOLD'] = float(clean_env('CLASSIFIER_THRESHOLD') or 0.9) #off-topic probability needed to skip the LLM
 
 app.config['SESSION_COOKIE_SECURE'] = True
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 
 init_db(app)
 app.register_blueprint(bp)
+
+#pdf worker processes are spawned and import this module as __mp_main__ under python app.py, they must not start these
+background_threads = __name__ != "__mp_main__"
+if background_threads and app.config['ROLLUP_INTERVAL']:
+    start_rollup_thread(app, app.config['ROLLUP_INTERVAL'])
+if background_threads and app.config['QUERY_PARTITION_INTERVAL']:
+    start_partition_thread(
+        app,
+        app.config['QUERY_PARTITION_INTERVAL'],
+        months_ahead=app.config['QUERY_PARTITION_MONTHS_AHEAD'],
+        archive_dir=app.config['QUERY_ARCHIVE_DIR'],
+        archive_after_months=app.config['QUERY_ARCHIVE_AFTER_MONTHS'],
+        archive_format=app.config['QUERY_ARCHIVE_FORMAT'],
+    )
 CORS(app, origins="*", supports_credentials=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+import json
+import mmap
+import os
+import sys
+import numpy as np
+from chatbot.ingest import Chunk, extract_faqs, ingest
+
+#binary corpus index, built offline and mmapped read-only by every worker:
+#MAGIC | uint64 header length | json header | 8-byte aligned array sections
+MAGIC = b"INFIDX01"
+ALIGN = 8
+
+def is_artifact(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+class MappedChunks:
+    """Sequence of Chunk tuples decoded on access from the mapped text blob."""
+
+    def __init__(self, urls, url_ids, offsets, text):
+        self.urls = urls
+        self.url_ids = url_ids
+        self.offsets = offsets
+        self.text = text
+
+    def __len__(self):
+        return len(self.url_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self[j] for j in range(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        text = self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+        return Chunk(self.urls[self.url_ids[i]], text)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def write_artifact(path, chunks, index, valid_urls, version, faqs=()):
+    urls = sorted({chunk.url for chunk in chunks})
+    url_ids = {url: i for i, url in enumerate(urls)}
+    encoded = [chunk.text.encode("utf-8") for chunk in chunks]
+
+    arrays = {
+        "chunk_urls": np.array([url_ids[chunk.url] for chunk in chunks], dtype=np.int32),
+        "chunk_offsets": np.concatenate(([0], np.cumsum([len(text) for text in encoded]))).astype(np.int64),
+        "text": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "indices": index.indices,
+        "row_ids": index.row_ids,
+        "data": index.data,
+    }
+
+    #section offsets are relative to the end of the header
+    sections = {}
+    offset = 0
+    for name, array in arrays.items():
+        sections[name] = {"dtype": array.dtype.str, "offset": offset, "count": int(array.size)}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+
+    header = json.dumps({
+        "version": version,
+        "urls": urls,
+        "valid_urls": sorted(valid_urls),
+        "vocabulary": index.vocabulary,
+        "faqs": [list(faq) for faq in faqs],
+        "sections": sections,
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    #write next to the target and rename, so a running worker never maps a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        for name, array in arrays.items():
+            data = array.tobytes()
+            f.write(data)
+            f.write(b"\0" * (-len(data) % ALIGN))
+    os.replace(tmp_path, path)
+
+def read_artifact(path):
+    #returns (header, arrays); the arrays are zero-copy read-only views over the mapped file
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a corpus index artifact")
+    header_len = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+    start = len(MAGIC) + 8
+    header = json.loads(bytes(buffer[start:start + header_len]))
+
+    base = start + header_len
+    arrays = {
+        name: np.frombuffer(buffer, dtype=np.dtype(section["dtype"]), count=section["count"], offset=base + section["offset"])
+        for name, section in header["sections"].items()
+    }
+    return header, arrays
+
+def build(content_path, artifact_path):
+    from chatbot.corpus import content_version, page_urls
+    from chatbot.retrieval import BM25Index
+
+    with open(content_path, "r", encoding="utf-8") as f:
+        full_text = f.read()
+    pages, chunks = ingest(full_text)
+    faqs = [faq for page in pages for faq in extract_faqs(page)]
+    write_artifact(artifact_path, chunks, BM25Index(chunks), page_urls(full_text), content_version(full_text), faqs)
+    return len(chunks)
+
+if __name__ == "__main__":
+    #python -m chatbot.artifact inforens_scraped_data.txt inforens_corpus.idx
+    if len(sys.argv) != 3:
+        print("Usage: python -m chatbot.artifact <content_file> <artifact_file>")
+        sys.exit(1)
+    count = build(sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} chunks to {sys.argv[2]}")
@@ -0,0 +1,90 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from rapidfuzz import fuzz, process
+
+NON_WORD = re.compile(r"[^a-z0-9]+")
+
+#words that only make sense with the previous turns, e.g. "what about it?" / "and there?"
+FOLLOW_UP_WORDS = frozenset("""
+it its that this those these they them their there he she his her more also else another same other again
+""".split())
+
+def normalize_question(question):
+    text = question.lower().replace("'", "").replace("’", "")
+    return NON_WORD.sub(" ", text).strip()
+
+def guard_tokens(text):
+    #short tokens and numbers (1/2, uk/us, phd/mba, 2025) flip the meaning but barely move a fuzzy score, they must match exactly;
+    #taken from the normalized words, not tokenize(), which drops single characters and stopwords like "us"
+    return frozenset(token for token in normalize_question(text).split() if len(token) <= 3 or token.isdigit())
+
+def depends_on_history(question, history):
+    if not history:
+        return False
+    words = normalize_question(question).split()
+    return len(words) < 3 or any(word in FOLLOW_UP_WORDS for word in words)
+
+class AnswerCache:
+    """LRU + TTL cache of chatbot answers, matched on normalized questions with RapidFuzz."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, threshold=92):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.corpus_version = None
+        self._entries = OrderedDict() #normalized question -> (expires_at, guard tokens, answer)
+        self._lock = threading.Lock()
+
+    def _check_version(self, corpus_version):
+        #the first corpus version seen is adopted, a reload switches it through clear(); requests still
+        #running on another snapshot neither read nor write entries
+        if self.corpus_version is None:
+            self.corpus_version = corpus_version
+        return corpus_version == self.corpus_version
+
+    def get(self, question, corpus_version):
+        key = normalize_question(question)
+        if not key:
+            return None
+
+        with self._lock:
+            if not self._check_version(corpus_version):
+                return None
+
+            match = key if key in self._entries else None
+            if match is None and self._entries:
+                found = process.extractOne(key, self._entries.keys(), scorer=fuzz.token_sort_ratio, score_cutoff=self.threshold)
+                if found and self._entries[found[0]][1] == guard_tokens(key):
+                    match = found[0]
+            if match is None:
+                return None
+
+            expires_at, _, answer = self._entries[match]
+            if expires_at < time.monotonic():
+                del self._entries[match]
+                return None
+            self._entries.move_to_end(match)
+            return copy.deepcopy(answer)
+
+    def put(self, question, corpus_version, answer):
+        key = normalize_question(question)
+        if not key:
+            return
+
+        with self._lock:
+            if not self._check_version(corpus_version):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, guard_tokens(key), copy.deepcopy(answer))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, corpus_version=None):
+        #called when a new corpus is swapped in: answers built from the old one are dropped
+        with self._lock:
+            self._entries.clear()
+            if corpus_version is not None:
+                self.corpus_version = corpus_version
@@ -1,116 +1,264 @@
 import requests
-import re
 import json
-from chatbot.helper import clean_json, remove_citations
-from cv_builder.parse_cv import extract_json_object
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import llm_client
+from chatbot.helper import remove_citations
+from chatbot.corpus import get_corpus, watch_corpus
+from chatbot.cache import depends_on_history
+from chatbot.faq import FAQ_THRESHOLD
+from chatbot.memory import InMemorySessionStore
+from chatbot.streaming import AnswerStream
+from chatbot.prompt import assemble_prompt, empty_breakdown
+from chatbot.summary import summarize_turns
+from llm_json import JSONExtractionError, UnexpectedJSON, parse_json_object
 
-#simple in session memory
-SESSION_MEMORY = {}
-MAX_TURNS = 6 #keep last 6 messages in memory (user - assistant pair. so that's last 3 questions from user including current question)
+VERBATIM_MESSAGES = 4 #last 2 user - assistant turns are always sent as they are
+SUMMARY_EVERY = 4 #older messages are folded into the running summary 2 turns at a time
+MAX_HISTORY_MESSAGES = 16 #hard cap on verbatim history in case summarizing falls behind
+CONTEXT_TOP_K = 5 #number of retrieved corpus chunks considered per question
+PROMPT_TOKEN_BUDGET = 4000 #estimated tokens per request across instructions, context, history and question
+
+CONTACT_URL = "https://www.inforens.com/contact-us"
+HTTP_ERROR_ANSWER = "Sorry, I’m having trouble responding right now. Please try again in a moment."
+NETWORK_ERROR_ANSWER = "I’m unable to connect right now. Please check your connection and try again."
+GENERIC_ERROR_ANSWER = "Something went wrong on our side. Please try again shortly."
 
 class PerplexityChatbot:
-    def __init__(self, api_key, content_file_path="inforens_scraped_data.txt"):
+    def __init__(self, api_key, content_file_path="inforens_scraped_data.txt", answer_cache=None, session_store=None,
+                 prompt_token_budget=PROMPT_TOKEN_BUDGET, classifier=None, faq_threshold=FAQ_THRESHOLD, reload_interval=0):
         self.api_key = api_key
         self.content_file_path = content_file_path
-        self.full_text = self._load_content()
-        self.valid_urls = self._extract_valid_urls()
+        self.answer_cache = answer_cache #optional AnswerCache shared by all sessions
+        self.sessions = session_store or InMemorySessionStore() #conversation summary + history per session_id
+        self._summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-summary")
+        self._summarizing = set()
+        self._summarizing_lock = threading.Lock()
+        self.prompt_token_budget = prompt_token_budget
+        self.classifier = classifier #optional FastPathClassifier for greetings, thanks and off-topic questions
+        self.faq_threshold = faq_threshold
+        get_corpus(content_file_path) #shared, loaded once per process
+        if reload_interval:
+            #the content file is rebuilt in the background when it changes, answers from the old content are dropped at the swap
+            watch_corpus(content_file_path, reload_interval, on_swap=self._on_corpus_swap)
+
+    @property
+    def corpus(self):
+        #current snapshot; a request reads this once and uses that snapshot throughout, even if a reload swaps it meanwhile
+        return get_corpus(self.content_file_path)
+
+    def _on_corpus_swap(self, corpus):
+        print(f"Corpus reloaded: version {corpus.version}, {len(corpus.chunks)} chunks")
+        if self.answer_cache is not None:
+            self.answer_cache.clear(corpus.version)
+
+    @property
+    def valid_urls(self):
+        return self.corpus.valid_urls
+
+    def search(self, question, k=CONTEXT_TOP_K):
+        #ranked corpus chunks for a question, best first
+        return [
+            {"url": chunk.url, "text": chunk.text, "score": score}
+            for chunk, score in self.corpus.index.search(question, k)
+        ]
+
+    def _retrieve(self, corpus, user_question):
+        chunks = [chunk for chunk, _ in corpus.index.search(user_question, CONTEXT_TOP_K)]
+        if not chunks: #nothing matched (e.g. small talk), fall back to the homepage
+            chunks = list(corpus.chunks[:1])
+        return chunks
+
+    def _remember(self, session_id, user_question, answer):
+        #appended to the stored session atomically, a summary or another request saving meanwhile is not overwritten
+        def append(session):
+            history = session["history"] + [
+                {"role": "user", "content": user_question},
+                {"role": "assistant", "content": answer},
+            ]
+            return {"summary": session["summary"], "history": history[-MAX_HISTORY_MESSAGES:]}
+        session = self.sessions.update(session_id, append)
 
-    def _load_content(self):
+        if len(session["history"]) >= VERBATIM_MESSAGES + SUMMARY_EVERY:
+            with self._summarizing_lock:
+                if session_id in self._summarizing:
+                    return
+                self._summarizing.add(session_id)
+            self._summarizer.submit(self._summarize, session_id)
+
+    def _summarize(self, session_id):
+        #runs off the request path: fold everything but the last few messages into the running summary
         try:
-            with open(self.content_file_path, "r", encoding="utf-8") as f:
-                return f.read()
-        except FileNotFoundError:
-            print("⚠️ Content file not found.")
-            return ""
-
-    def _extract_valid_urls(self):
-        urls = set(re.findall(r"https?://[^\s,)]+", self.full_text))
-        return urls
-
-    def _postprocess_answer(self, answer):
-        # Remove numbered citation marks ([1][2] etc).
-        answer = re.sub(r'\[\d+\]', '', answer)
-        answer = re.sub(r"\[https?://([^\]]+)\]\(https?://[^\)]+\)", r"https://\1", answer)
-        return answer
+            session = self.sessions.get(session_id)
+            folded = session["history"][:-VERBATIM_MESSAGES]
+            if len(folded) < SUMMARY_EVERY:
+                return
+            summary = summarize_turns(session["summary"], folded)
+
+            #compare and save in one step: only if no other writer replaced the messages we folded in the meantime,
+            #turns remembered while summarizing are kept
+            def fold(latest):
+                if latest["history"][:len(folded)] != folded:
+                    return None
+                return {"summary": summary, "history": latest["history"][len(folded):]}
+            self.sessions.update(session_id, fold)
+        except Exception as e:
+            print(f"Error summarizing session: {str(e)}")
+        finally:
+            with self._summarizing_lock:
+                self._summarizing.discard(session_id)
+
+    def _build_messages(self, corpus, user_question, session):
+        #only the pages relevant to this question, then the summary and as much history as the token budget allows
+        return assemble_prompt(
+            user_question,
+            self._retrieve(corpus, user_question),
+            session["history"],
+            self.prompt_token_budget,
+            summary=session["summary"]
+        )
+
+    def _fast_path(self, user_question, history):
+        #answered locally, not remembered: small talk adds nothing the next question needs
+        if self.classifier is None:
+            return None
+        result = self.classifier.answer(user_question, history)
+        if result:
+            result["prompt_tokens"] = empty_breakdown()
+        return result
+
+    def _lookup(self, corpus, user_question, history):
+        #standalone questions can be answered from the corpus faqs or the cache, follow-ups need the full conversation
+        if depends_on_history(user_question, history):
+            return False, None
+        faq = corpus.faqs.answer(user_question, self.faq_threshold)
+        if faq:
+            faq["prompt_tokens"] = empty_breakdown()
+            return False, faq
+        use_cache = self.answer_cache is not None
+        cached = self.answer_cache.get(user_question, corpus.version) if use_cache else None
+        if cached:
+            cached["source"] = "answer-cache"
+            cached["prompt_tokens"] = empty_breakdown()
+        return use_cache, cached
+
+    def _finish(self, corpus, user_question, session_id, use_cache, raw_answer):
+        #parse the model output, then remember and cache the answer if it is usable
+        try:
+            parsed = parse_json_object(raw_answer, required=("answer", "links"))
+        except UnexpectedJSON:
+            return {
+                "answer": "Sorry, something went wrong while processing the response.",
+                "links": [CONTACT_URL]
+            }
+        except JSONExtractionError:
+            print(raw_answer)
+            return {
+                "answer": "Sorry, I couldn’t generate a response right now. Please try again.",
+                "links": [CONTACT_URL]
+                }
+        #model links are only kept if they point at a page we have, otherwise at the nearest one
+        parsed["answer"], parsed["links"] = corpus.links.validate(remove_citations(parsed["answer"]), parsed["links"])
+        self._remember(session_id, user_question, parsed["answer"])
+        if use_cache:
+            self.answer_cache.put(user_question, corpus.version, parsed)
+        return parsed
 
     def ask_question(self, user_question, session_id):
-        if not self.full_text:
-            return {"answer": "Sorry, something went wrong. Please try again.", "links": ["https://www.inforens.com/contact-us"]}
+        corpus = self.corpus
+        if not corpus.chunks:
+            return {"answer": "Sorry, something went wrong. Please try again.", "links": [CONTACT_URL], "prompt_tokens": empty_breakdown()}
         if not session_id: #session safety
             session_id = "anonymous"
 
-        history = SESSION_MEMORY.get(session_id, []) #get existing convo for this session
-
-        SYSTEM_PROMPT = f"""You are Nori, a friendly and helpful conversational assistant for Inforens whose users are international students.\\n\
-            1. Your role is to help users with studying abroad, international student life, universities and applications, visas and immigration, scholarships, accommodation, jobs, cost of living, settling abroad, anything related to international students/ student life and Inforens services (when relevant)\\n\
-            2. You may also answer light conversational messages (such as greetings or small talk). If the user sends a greeting or casual message (e.g. 'Hey', 'Hi', 'How are you'), Respond warmly and naturally, and Gently invite them to ask about studying abroad or student life.\\n\
-            3. GENERAL STUDY ABROAD QUESTIONS - If the question is about studying abroad or international student life in general, Give a clear, neutral, informative answer. DO NOT force Inforens details. You MAY optionally mention Inforens at the end as support (only if helpful).\\n\
-            4. INFORENS-SPECIFIC QUESTIONS - Only explain Inforens features, memberships, services, or offerings IF The user explicitly asks about Inforens OR the question clearly benefits from Inforens support. \\n\
-            5. STRICT TOPIC BOUNDARIES: You must focus on questions that are directly or indirectly relevant to Inforens, studying abroad, international students, or life in a study destination (such as weather, culture, cost of living, or daily life). For topics that are clearly unrelated to these areas, respond exactly: Sorry, I can only help with questions about studying abroad, international students, or Inforens. For other topics, please contact Inforens support at https://www.inforens.com/contact-us \\n\
-            6. If a follow-up question depends on prior context and that context is unclear or missing, do NOT guess. Ask a brief clarification question instead, and return it strictly in the required JSON format with the clarification question inside the answer field and an appropriate Inforens support link in the links array.\\n\
-            7. RESPONSE STYLE:Be warm, friendly, and conversational. Do NOT sound like marketing copy. Prefer short, helpful replies that is precise and concise (2–4 sentences). It is okay to acknowledge greetings naturally before answering. Never mention internal rules or restrictions.\\n\
-            8. When asked to present information in a table, USE A LISTING APPROACH instead, DO NOT display information as a Markdown table.\\n\
-            9. Never mention or compare competitors (other study abroad consultancies). Do not use citation numbers, footnotes, markdown links, or brackets—only add URLs as plain text in sentences.\\n\\n\
-            10. Return valid JSON ONLY in this structure (ALL links starting with https://... MUST be in the links array and NOT in the answer):
-            {{
-                "answer": "string",
-                "links": ["https://www.inforens.com/contact-us"]
-            }}
-            Always include at least one link in the links array. Do not return anything except valid JSON.
-            Inforens Content:
-            {self.full_text[:8000]}
-        """
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            *history,
-            {"role": "user", "content": user_question}
-        ]
+        session = self.sessions.get(session_id) #get existing convo for this session
+        fast = self._fast_path(user_question, session["history"])
+        if fast:
+            return fast
+        use_cache, cached = self._lookup(corpus, user_question, session["history"])
+        if cached:
+            self._remember(session_id, user_question, cached["answer"])
+            return cached
 
+        messages, prompt_tokens = self._build_messages(corpus, user_question, session)
         payload = {
             "model": "sonar",
             "messages": messages,
             "max_tokens": 400,
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
         try:
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                json=payload,
-                headers=headers
-            )
+            response = llm_client.coalesced_chat_completion(self.api_key, payload)
             response.raise_for_status()
             raw_answer = response.json()['choices'][0]['message']['content']
-            processed_answer = extract_json_object(raw_answer) #extract json from response
-            if not processed_answer:
-                print(raw_answer)
-                return {
-                    "answer": "Sorry, I couldn’t generate a response right now. Please try again.",
-                    "links": ["https://www.inforens.com/contact-us"]
-                    }
-            processed_answer = clean_json(processed_answer)
-            parsed = json.loads(processed_answer)
-            parsed["answer"] = remove_citations(parsed["answer"])
-            if "answer" not in parsed or "links" not in parsed:
-                return {
-                "answer": "Sorry, something went wrong while processing the response.",
-                "links": ["https://www.inforens.com/contact-us"]
-            }
-            history.append({"role": "user", "content": user_question})
-            history.append({"role": "assistant", "content": parsed["answer"]})
-            SESSION_MEMORY[session_id] = history[-MAX_TURNS:]
-            return parsed
-        except requests.exceptions.HTTPError as e:
+            result = self._finish(corpus, user_question, session_id, use_cache, raw_answer)
+        except requests.exceptions.HTTPError:
+            print("Perplexity API returned an HTTP error")
+            result = {"answer": HTTP_ERROR_ANSWER, "links": [CONTACT_URL]}
+        except requests.exceptions.RequestException:
+            print("Network error while calling Perplexity API")
+            result = {"answer": NETWORK_ERROR_ANSWER, "links": [CONTACT_URL]}
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            result = {"answer": GENERIC_ERROR_ANSWER, "links": [CONTACT_URL]}
+        result["prompt_tokens"] = prompt_tokens
+        return result
+
+    def ask_question_stream(self, user_question, session_id):
+        """Same as ask_question, but yields ("token", text) as the answer is generated and ends with ("done", result)."""
+        corpus = self.corpus
+        if not corpus.chunks:
+            yield "done", {"answer": "Sorry, something went wrong. Please try again.", "links": [CONTACT_URL], "prompt_tokens": empty_breakdown()}
+            return
+        if not session_id: #session safety
+            session_id = "anonymous"
+
+        session = self.sessions.get(session_id)
+        fast = self._fast_path(user_question, session["history"])
+        if fast:
+            yield "token", fast["answer"]
+            yield "done", fast
+            return
+        use_cache, cached = self._lookup(corpus, user_question, session["history"])
+        if cached:
+            self._remember(session_id, user_question, cached["answer"])
+            yield "token", cached["answer"]
+            yield "done", cached
+            return
+
+        messages, prompt_tokens = self._build_messages(corpus, user_question, session)
+        payload = {
+            "model": "sonar",
+            "messages": messages,
+            "max_tokens": 400,
+            "stream": True,
+        }
+
+        answer_stream = AnswerStream()
+        result = None
+        try:
+            with llm_client.chat_completion(self.api_key, payload, stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:"): #sse comments and keep-alives
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    text = answer_stream.feed(choices[0].get("delta", {}).get("content") or "")
+                    if text:
+                        yield "token", text
+            result = self._finish(corpus, user_question, session_id, use_cache, answer_stream.raw)
+        except requests.exceptions.HTTPError:
             print("Perplexity API returned an HTTP error")
-            return {"answer": "Sorry, I’m having trouble responding right now. Please try again in a moment.", "links": ["https://www.inforens.com/contact-us"]}
+            result = {"answer": HTTP_ERROR_ANSWER, "links": [CONTACT_URL]}
         except requests.exceptions.RequestException:
             print("Network error while calling Perplexity API")
-            return { "answer": "I’m unable to connect right now. Please check your connection and try again.", "links": ["https://www.inforens.com/contact-us"]}
-        
-        except Exception:
+            result = {"answer": NETWORK_ERROR_ANSWER, "links": [CONTACT_URL]}
+        except Exception as e:
             print(f"Error: {str(e)}")
-            return { "answer": "Something went wrong on our side. Please try again shortly.", "links": ["https://www.inforens.com/contact-us"] }
\ No newline at end of file
+            result = {"answer": GENERIC_ERROR_ANSWER, "links": [CONTACT_URL]}
+        result["prompt_tokens"] = prompt_tokens
+        yield "done", result
@@ -0,0 +1,157 @@
+import re
+import sys
+import zlib
+import numpy as np
+from chatbot.cache import normalize_question, depends_on_history
+
+#answers small talk and obvious off-topic questions locally, so they never reach the LLM
+
+HOME_URL = "https://www.inforens.com/"
+CONTACT_URL = "https://www.inforens.com/contact-us"
+
+GREETING_ANSWER = "Hi, I'm Nori! I can help with studying abroad, student life, visas, scholarships and Inforens services. What would you like to know?"
+THANKS_ANSWER = "You're welcome! Let me know if there's anything else I can help you with about studying abroad or Inforens."
+#same text the system prompt asks the model to use for off-topic questions (rule 5)
+OFF_TOPIC_ANSWER = "Sorry, I can only help with questions about studying abroad, international students, or Inforens. For other topics, please contact Inforens support at https://www.inforens.com/contact-us"
+
+GREETING = re.compile(
+    r"^(hi+|hello+|hey+|hiya|howdy|greetings|good (morning|afternoon|evening))( there| nori| team| everyone)?"
+    r"( how are you( doing)?| hows it going)?$"
+    r"|^(how are you( doing)?|hows it going|whats up)( nori)?$"
+)
+#"ok"/"yes"/"sure" are left out on purpose, they usually answer a clarification question
+THANKS = re.compile(r"^(thanks?|thank you|thankyou|thx|ty|cheers)( (so|very) much| a lot| nori)?( (thanks?|thank you))?$")
+
+#topics rule 5 refuses, only trusted when no study abroad word appears in the question
+#(sport, food and films are left to the model, they can be about life in a study destination)
+OFF_TOPIC_TERMS = frozenset("""
+recipe recipes bitcoin crypto cryptocurrency lottery casino gambling poem poems lyrics joke jokes horoscope
+celebrity celebrities porn fortnite minecraft nba ipl
+""".split())
+DOMAIN_TERMS = frozenset("""
+study studying student students university universities uni college course courses degree masters phd mba
+visa visas scholarship scholarships abroad inforens mentor mentors accommodation housing rent job jobs internship
+ielts toefl gre gmat sop lor cv application apply admission admissions campus country countries city cost living
+uk usa us ireland canada australia germany france netherlands london bank sim loan fees tuition flight
+""".split())
+
+HASH_DIM = 2 ** 12
+
+def features(question):
+    #hashed unigrams + bigrams; crc32 is stable across processes, unlike hash()
+    words = normalize_question(question).split()
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    x = np.zeros(HASH_DIM, dtype=np.float32)
+    for gram in grams:
+        x[zlib.crc32(gram.encode("utf-8")) % HASH_DIM] += 1.0
+    norm = np.linalg.norm(x)
+    return x / norm if norm else x
+
+class OffTopicModel:
+    """Logistic regression over hashed n-grams: probability that a question is off-topic."""
+
+    def __init__(self, weights, bias):
+        self.weights = weights
+        self.bias = bias
+
+    def probability(self, question):
+        return float(1.0 / (1.0 + np.exp(-(features(question) @ self.weights + self.bias))))
+
+    @classmethod
+    def train(cls, questions, labels, epochs=300, learning_rate=0.5, l2=1e-4):
+        X = np.stack([features(q) for q in questions])
+        y = np.asarray(labels, dtype=np.float32)
+        weights = np.zeros(HASH_DIM, dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            error = 1.0 / (1.0 + np.exp(-(X @ weights + bias))) - y
+            weights -= learning_rate * (X.T @ error / len(y) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        return cls(weights, bias)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, weights=self.weights, bias=np.array([self.bias]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["weights"], float(data["bias"][0]))
+
+class FastPathClassifier:
+    def __init__(self, model=None, threshold=0.9):
+        self.model = model #optional OffTopicModel, only consulted for questions without study abroad words
+        self.threshold = threshold
+
+    def classify(self, question, history=None):
+        #returns "greeting", "thanks", "off_topic" or None for a real question
+        text = normalize_question(question)
+        if not text:
+            return None
+        if GREETING.match(text):
+            return "greeting"
+        if THANKS.match(text):
+            return "thanks"
+
+        #a follow up like "what about the lottery there?" needs the conversation to judge
+        if depends_on_history(question, history or []):
+            return None
+        words = set(text.split())
+        if words & DOMAIN_TERMS:
+            return None
+        if words & OFF_TOPIC_TERMS:
+            return "off_topic"
+        if self.model is not None and self.model.probability(question) >= self.threshold:
+            return "off_topic"
+        return None
+
+    def answer(self, question, history=None):
+        label = self.classify(question, history)
+        if label == "greeting":
+            return {"answer": GREETING_ANSWER, "links": [HOME_URL], "source": "fast-path"}
+        if label == "thanks":
+            return {"answer": THANKS_ANSWER, "links": [HOME_URL], "source": "fast-path"}
+        if label == "off_topic":
+            return {"answer": OFF_TOPIC_ANSWER, "links": [CONTACT_URL], "source": "fast-path"}
+        return None
+
+def load_classifier(model_path=None, threshold=0.9):
+    model = None
+    if model_path:
+        try:
+            model = OffTopicModel.load(model_path)
+        except FileNotFoundError:
+            print("⚠️ Classifier model not found, using rules only.")
+    return FastPathClassifier(model, threshold)
+
+def train_from_queries(output_path):
+    #labels come from logged answers: the model's fixed off-topic reply marks an off-topic question
+    from app import app
+    from models import Query
+
+    with app.app_context():
+        rows = Query.query.with_entities(Query.question, Query.answer).filter(
+            Query.success.is_(True),
+            Query.answer.isnot(None),
+            #questions answered by this classifier would only teach the model its own rules
+            Query.model.is_(None) | ~Query.model.startswith("fast-path"),
+        ).all()
+
+    questions = [row.question for row in rows]
+    labels = [row.answer.strip().startswith(OFF_TOPIC_ANSWER[:60]) for row in rows]
+    if not questions or all(labels) or not any(labels):
+        print("Need logged examples of both on-topic and off-topic questions to train.")
+        return None
+
+    model = OffTopicModel.train(questions, labels)
+    model.save(output_path)
+    return len(questions), sum(labels)
+
+if __name__ == "__main__":
+    #python -m chatbot.classifier offtopic_model.npz
+    if len(sys.argv) != 2:
+        print("Usage: python -m chatbot.classifier <model_output_file>")
+        sys.exit(1)
+    trained = train_from_queries(sys.argv[1])
+    if trained:
+        print(f"Trained on {trained[0]} questions ({trained[1]} off-topic), saved to {sys.argv[1]}")
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+from chatbot.artifact import MappedChunks, is_artifact, read_artifact
+from chatbot.faq import FaqTable
+from chatbot.ingest import HOME_URL, PAGE_MARKER, FaqEntry, extract_faqs, ingest
+from chatbot.links import CONTACT_URL, LinkIndex
+from chatbot.retrieval import BM25Index
+
+
+#process wide cache of loaded corpora, keyed by file path
+_CORPORA = {}
+_CORPORA_LOCK = threading.Lock()
+_WATCHERS = {}
+
+def page_urls(full_text):
+    #only the scraped pages are valid links, urls inside the text are often glued to the next word ("guidesDiscover")
+    urls = set(PAGE_MARKER.findall(full_text)) or {HOME_URL}
+    urls.add(CONTACT_URL)
+    return urls
+
+def content_version(full_text):
+    #identifies the content a corpus (and anything derived from it, like cached answers) was built from
+    return hashlib.sha256(full_text.encode("utf-8")).hexdigest()[:16]
+
+class Corpus:
+    """Read-only snapshot of the scraped Inforens content and its derived index, shared by all requests."""
+
+    __slots__ = ("path", "version", "valid_urls", "links", "chunks", "index", "faqs")
+
+    def __init__(self, path, version, valid_urls, chunks, index, faqs=()):
+        values = {
+            "path": path,
+            "version": version,
+            "valid_urls": frozenset(valid_urls),
+            "links": LinkIndex(valid_urls), #maps any link to the nearest valid page
+            "chunks": chunks,
+            "index": index,
+            "faqs": FaqTable(faqs), #question/answer pairs mined from numbered faq blocks
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Corpus snapshots are immutable")
+
+    @classmethod
+    def from_text(cls, path, full_text):
+        #only the cleaned chunks are kept, the raw text is dropped once ingested
+        pages, chunks = ingest(full_text)
+        chunks = tuple(chunks)
+        faqs = [faq for page in pages for faq in extract_faqs(page)]
+        return cls(path, content_version(full_text), page_urls(full_text), chunks, BM25Index(chunks), faqs)
+
+    @classmethod
+    def from_artifact(cls, path):
+        #chunk text and index arrays stay in the mapped file, shared with other workers via the page cache
+        header, arrays = read_artifact(path)
+        chunks = MappedChunks(header["urls"], arrays["chunk_urls"], arrays["chunk_offsets"], arrays["text"])
+        index = BM25Index.from_arrays(chunks, header["vocabulary"], arrays["indices"], arrays["row_ids"], arrays["data"])
+        faqs = [FaqEntry(*faq) for faq in header.get("faqs", [])] #artifacts built before faqs were mined have none
+        return cls(path, header["version"], header["valid_urls"], chunks, index, faqs)
+
+def _read_content(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        print("⚠️ Content file not found.")
+        return ""
+
+def load_corpus(path):
+    #CONTENT_FILE may point at the raw scraped text or at an index built with `python -m chatbot.artifact`
+    if is_artifact(path):
+        return Corpus.from_artifact(path)
+    return Corpus.from_text(path, _read_content(path))
+
+def get_corpus(path):
+    #build the snapshot once per process, every later call returns the same object (until a watcher swaps it)
+    corpus = _CORPORA.get(path)
+    if corpus is not None:
+        return corpus
+
+    with _CORPORA_LOCK:
+        corpus = _CORPORA.get(path)
+        if corpus is None:
+            corpus = load_corpus(path)
+            _CORPORA[path] = corpus
+    return corpus
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class CorpusWatcher:
+    """Polls the content file and swaps in a rebuilt snapshot when it changes, off the request path."""
+
+    def __init__(self, path, interval=30):
+        self.path = path
+        self.interval = interval
+        self.listeners = [] #called with the new corpus after every swap
+        self._loaded = _file_signature(path)
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error reloading corpus: {str(e)}")
+
+    def check(self):
+        #returns the new corpus if it was swapped in, otherwise None
+        signature = _file_signature(self.path)
+        if signature is None or signature == self._loaded:
+            return None
+        if signature != self._pending:
+            #changed since the last poll, it may still be being written: wait until it holds still for one interval
+            self._pending = signature
+            return None
+
+        corpus = load_corpus(self.path)
+        if _file_signature(self.path) != signature:
+            return None #rewritten while we were reading it, try again on the next poll
+        self._loaded = signature
+        self._pending = None
+
+        current = _CORPORA.get(self.path)
+        if current is not None and current.version == corpus.version:
+            return None #touched but same content
+
+        #snapshots are immutable, so replacing the reference is the whole swap
+        with _CORPORA_LOCK:
+            _CORPORA[self.path] = corpus
+        for listener in self.listeners:
+            listener(corpus)
+        return corpus
+
+def watch_corpus(path, interval=30, on_swap=None):
+    #one watcher thread per content file and process
+    with _CORPORA_LOCK:
+        watcher = _WATCHERS.get(path)
+        if watcher is None:
+            watcher = CorpusWatcher(path, interval)
+            _WATCHERS[path] = watcher
+            watcher.start()
+    if on_swap is not None:
+        watcher.listeners.append(on_swap)
+    return watcher
@@ -0,0 +1,37 @@
+from rapidfuzz import fuzz, process
+from chatbot.cache import normalize_question, guard_tokens
+
+FAQ_THRESHOLD = 88 #rapidfuzz token_sort_ratio, 0-100
+
+class FaqTable:
+    """Question/answer pairs mined from the corpus FAQ blocks, matched on normalized questions with RapidFuzz."""
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self._keys = {} #normalized question -> entry
+        for entry in self.entries:
+            self._keys.setdefault(normalize_question(entry.question), entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def match(self, question, threshold=FAQ_THRESHOLD):
+        #returns the FaqEntry for a close enough question, or None
+        key = normalize_question(question)
+        if not key or not self._keys:
+            return None
+        if key in self._keys:
+            return self._keys[key]
+        found = process.extractOne(key, self._keys.keys(), scorer=fuzz.token_sort_ratio, score_cutoff=threshold)
+        if found and guard_tokens(found[0]) == guard_tokens(key):
+            return self._keys[found[0]]
+        return None
+
+    def answer(self, question, threshold=FAQ_THRESHOLD):
+        entry = self.match(question, threshold)
+        if entry is None:
+            return None
+        return {"answer": entry.answer, "links": [entry.url], "source": "faq"}
@@ -0,0 +1,119 @@
+import re
+from collections import namedtuple
+
+PAGE_MARKER = re.compile(r"^--(https?://\S+?)--\s*$", re.MULTILINE) #pages are delimited by --https://...-- lines
+
+HOME_URL = "https://www.inforens.com/"
+CHUNK_CHARS = 1500 #max size of a retrievable chunk, long pages (blogs) are split into several
+SHINGLE_WORDS = 8 #length of the word n-grams used to detect repeated text
+BOILERPLATE_RATIO = 0.5 #a shingle on at least this share of pages is treated as shared nav/footer
+FAQ_ITEM = re.compile(r"(?:^|\s)(\d{1,2}) \. ([^?]{3,200}\?)") #"1 . What can Inforens do for me?"
+FAQ_END = re.compile(r"\s*\b(View More Questions|View all)\b") #link closing an faq block
+MIN_FAQ_ANSWER_CHARS = 20 #collapsed faq items leave no (or a stray word of) answer in the scrape
+
+Page = namedtuple("Page", ["url", "text"])
+Chunk = namedtuple("Chunk", ["url", "text"])
+FaqEntry = namedtuple("FaqEntry", ["url", "question", "answer"])
+
+def split_pages(full_text):
+    markers = list(PAGE_MARKER.finditer(full_text))
+    if not markers:
+        text = full_text.strip()
+        return [Page(HOME_URL, text)] if text else []
+
+    pages = []
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(full_text)
+        text = full_text[marker.end():end].strip()
+        if text:
+            pages.append(Page(marker.group(1), text))
+    return pages
+
+def _shingles(words):
+    return [hash(tuple(words[i:i + SHINGLE_WORDS])) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+def _drop_marked(words, shingles, is_marked):
+    #remove every word covered by a marked shingle
+    keep = [True] * len(words)
+    for i, shingle in enumerate(shingles):
+        if is_marked(i, shingle):
+            for j in range(i, i + SHINGLE_WORDS):
+                keep[j] = False
+    return [word for word, kept in zip(words, keep) if kept]
+
+def strip_boilerplate(pages):
+    #spans repeated across most pages (nav header, footer) carry no page specific information
+    if len(pages) < 2:
+        return list(pages)
+
+    page_words = [page.text.split() for page in pages]
+    page_shingles = [_shingles(words) for words in page_words]
+
+    page_counts = {}
+    for shingles in page_shingles:
+        for shingle in set(shingles):
+            page_counts[shingle] = page_counts.get(shingle, 0) + 1
+
+    threshold = max(2, BOILERPLATE_RATIO * len(pages))
+    stripped = []
+    for page, words, shingles in zip(pages, page_words, page_shingles):
+        kept = _drop_marked(words, shingles, lambda i, shingle: page_counts[shingle] >= threshold)
+        stripped.append(Page(page.url, " ".join(kept)))
+    return stripped
+
+def collapse_duplicates(page):
+    #drop passages repeated inside one page (e.g. carousels rendered twice), keeping the first copy
+    words = page.text.split()
+    shingles = _shingles(words)
+
+    first_seen = {}
+    for i, shingle in enumerate(shingles):
+        first_seen.setdefault(shingle, i)
+
+    #only an earlier, non-overlapping occurrence counts, so a run of one repeated word keeps its first copy
+    kept = _drop_marked(words, shingles, lambda i, shingle: first_seen[shingle] + SHINGLE_WORDS <= i)
+    return Page(page.url, " ".join(kept))
+
+def chunk_page(page, max_chars=CHUNK_CHARS):
+    #split on whitespace into chunks of at most max_chars, every chunk keeps its page url
+    chunks = []
+    words = []
+    size = 0
+    for word in page.text.split():
+        if words and size + len(word) + 1 > max_chars:
+            chunks.append(Chunk(page.url, " ".join(words)))
+            words = []
+            size = 0
+        words.append(word)
+        size += len(word) + 1
+    if words:
+        chunks.append(Chunk(page.url, " ".join(words)))
+    return chunks
+
+def extract_faqs(page):
+    #numbered "N . question? answer" blocks; an answer runs until the next item of its block
+    items = []
+    for match in FAQ_ITEM.finditer(page.text):
+        number = int(match.group(1))
+        if number == 1 or (items and number == items[-1][0] + 1):
+            items.append((number, match))
+
+    faqs = []
+    for i, (number, match) in enumerate(items):
+        following = items[i + 1] if i + 1 < len(items) else None
+        answer = page.text[match.end():following[1].start() if following else len(page.text)]
+        if not following or following[0] != number + 1:
+            #last item of a block: only trust the answer if the block visibly ends (e.g. "View More Questions")
+            end = FAQ_END.search(answer)
+            answer = answer[:end.start()] if end else ""
+        answer = answer.strip()
+        if len(answer) >= MIN_FAQ_ANSWER_CHARS:
+            faqs.append(FaqEntry(page.url, " ".join(match.group(2).split()), answer))
+    return faqs
+
+def ingest(full_text):
+    """Split raw scraped content into cleaned pages and retrievable chunks."""
+    pages = [collapse_duplicates(page) for page in strip_boilerplate(split_pages(full_text))]
+    pages = [page for page in pages if page.text]
+    chunks = [chunk for page in pages for chunk in chunk_page(page)]
+    return pages, chunks
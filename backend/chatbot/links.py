@@ -0,0 +1,77 @@
+import re
+from urllib.parse import urlsplit
+from rapidfuzz import fuzz, process
+
+CONTACT_URL = "https://www.inforens.com/contact-us"
+#a markdown link "[label](url)" or a bare url; both are rewritten in the same pass
+LINK_PATTERN = re.compile(r"\[([^\]\n]*)\]\((https?://[^\s)]+)\)|https?://[^\s,)\]]+")
+TRAILING = ".!?;:'\"" #sentence punctuation glued to the end of a url
+FUZZY_THRESHOLD = 80 #rapidfuzz ratio between paths to accept a near miss like /features/sim-card
+
+def _split(url):
+    #(host, path segments) with the scheme, "www.", query and fragment ignored and everything lowercased
+    parts = urlsplit(url.strip().rstrip(TRAILING))
+    host = parts.netloc.lower().removeprefix("www.")
+    return host, [segment for segment in parts.path.lower().split("/") if segment]
+
+class LinkIndex:
+    """Path trie over the corpus page urls, maps any link to the nearest page we actually have."""
+
+    def __init__(self, urls, fallback=CONTACT_URL):
+        self.fallback = fallback
+        self._root = {} #host -> node; a node is {"url": canonical url or None, "children": {segment: node}}
+        self._paths = {} #host -> {"segment/segment": canonical url} for fuzzy matching
+        for url in sorted(urls):
+            host, segments = _split(url)
+            if not host:
+                continue
+            node = self._root.setdefault(host, {"url": None, "children": {}})
+            for segment in segments:
+                node = node["children"].setdefault(segment, {"url": None, "children": {}})
+            if node["url"] is None:
+                node["url"] = url
+            self._paths.setdefault(host, {}).setdefault("/".join(segments), url)
+
+    def canonical(self, url):
+        host, segments = _split(url)
+        node = self._root.get(host)
+        if node is None:
+            return self.fallback
+
+        #walk as deep as the path matches, remembering the deepest page below the site root
+        prefix_match = None
+        for segment in segments:
+            node = node["children"].get(segment)
+            if node is None:
+                break
+            if node["url"]:
+                prefix_match = node["url"]
+        else:
+            if node["url"]:
+                return node["url"]
+
+        found = process.extractOne("/".join(segments), self._paths[host].keys(), scorer=fuzz.ratio, score_cutoff=FUZZY_THRESHOLD)
+        if found:
+            return self._paths[host][found[0]]
+        return prefix_match or self.fallback
+
+    def _replace(self, match):
+        if match.group(2): #markdown link, keep the label as text and the url as a plain link
+            label, url = match.group(1).strip(), self.canonical(match.group(2))
+            return url if not label or label.startswith("http") else f"{label} ({url})"
+        text = match.group(0)
+        url = text.rstrip(TRAILING)
+        return self.canonical(url) + text[len(url):]
+
+    def validate(self, answer, links):
+        """Returns (answer, links) with every url in either one replaced by its canonical corpus page."""
+        answer = LINK_PATTERN.sub(self._replace, answer)
+        if isinstance(links, str):
+            links = [links]
+        canonical = []
+        for link in links or []:
+            if isinstance(link, str) and link.strip():
+                url = self.canonical(link)
+                if url not in canonical:
+                    canonical.append(url)
+        return answer, canonical or [self.fallback]
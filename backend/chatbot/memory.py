@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, ChatSession
+
+PRUNE_EVERY = 500 #database store: delete expired sessions once every N saves
+
+#a session is {"summary": running summary of older turns, "history": recent verbatim messages}
+def empty_session():
+    return {"summary": "", "history": []}
+
+class InMemorySessionStore:
+    """Per-process conversation state, bounded by LRU eviction and a TTL."""
+
+    def __init__(self, max_sessions=10000, ttl_seconds=86400):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict() #session_id -> (expires_at, summary, history)
+        self._lock = threading.Lock()
+
+    def _get(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return empty_session()
+        expires_at, summary, history = entry
+        if expires_at < time.monotonic():
+            del self._sessions[session_id]
+            return empty_session()
+        self._sessions.move_to_end(session_id)
+        return {"summary": summary, "history": list(history)}
+
+    def _save(self, session_id, session):
+        self._sessions[session_id] = (time.monotonic() + self.ttl_seconds, session["summary"], tuple(session["history"]))
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self._lock:
+            return self._get(session_id)
+
+    def save(self, session_id, session):
+        with self._lock:
+            self._save(session_id, session)
+
+    def update(self, session_id, change):
+        #atomic read-modify-write: change(session) returns the new session, or None to keep the current one
+        with self._lock:
+            session = self._get(session_id)
+            changed = change(session)
+            if changed is None:
+                return session
+            self._save(session_id, changed)
+            return changed
+
+class DatabaseSessionStore:
+    """Conversation state in the chat_sessions table, shared by every worker (Postgres or SQLite)."""
+
+    def __init__(self, app, ttl_seconds=86400):
+        self.app = app #own app context, so background summary jobs can use the store too
+        self.ttl_seconds = ttl_seconds
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def _cutoff(self):
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+
+    def _session(self, row):
+        if row is None:
+            return empty_session()
+        updated_at = row.updated_at
+        if updated_at.tzinfo is None: #sqlite drops the timezone
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        if updated_at < self._cutoff():
+            return empty_session()
+        return {"summary": row.summary or "", "history": list(row.history)}
+
+    def _write(self, session_id, session):
+        #upsert inside the caller's transaction
+        values = {
+            "session_id": session_id,
+            "summary": session["summary"],
+            "history": list(session["history"]),
+            "updated_at": datetime.now(timezone.utc),
+        }
+        insert = pg_insert if db.engine.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(ChatSession).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ChatSession.session_id],
+            set_={
+                "summary": stmt.excluded.summary,
+                "history": stmt.excluded.history,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        db.session.execute(stmt)
+
+        with self._lock:
+            self._saves += 1
+            prune = self._saves % PRUNE_EVERY == 0
+        if prune:
+            db.session.execute(db.delete(ChatSession).where(ChatSession.updated_at < self._cutoff()))
+
+    def get(self, session_id):
+        with self.app.app_context():
+            return self._session(db.session.get(ChatSession, session_id))
+
+    def save(self, session_id, session):
+        with self.app.app_context():
+            self._write(session_id, session)
+            db.session.commit()
+
+    def update(self, session_id, change):
+        #atomic read-modify-write: the row stays locked (SELECT ... FOR UPDATE) until the change is committed;
+        #change(session) returns the new session, or None to keep the current one
+        with self.app.app_context():
+            row = db.session.execute(
+                db.select(ChatSession).where(ChatSession.session_id == session_id).with_for_update()
+            ).scalar_one_or_none()
+            session = self._session(row)
+            changed = change(session)
+            if changed is None:
+                db.session.rollback()
+                return session
+            self._write(session_id, changed)
+            db.session.commit()
+            return changed
+
+def create_session_store(kind="memory", max_sessions=10000, ttl_seconds=86400, app=None):
+    if kind == "memory":
+        return InMemorySessionStore(max_sessions, ttl_seconds)
+    if kind == "database":
+        return DatabaseSessionStore(app, ttl_seconds)
+    raise ValueError(f"Unknown session store: {kind}")
@@ -0,0 +1,95 @@
+#system prompt, token estimation and budgeted assembly of the chat messages sent upstream
+
+CHARS_PER_TOKEN = 4 #rough average for English text, good enough to budget without a real tokenizer
+MESSAGE_OVERHEAD_TOKENS = 4 #role and formatting tokens added per message
+MESSAGE_MAX_TOKENS = 400 #a single history message or question is truncated to this size
+CONTEXT_MAX_TOKENS = 2000 #retrieved content may use at most this much of the budget
+
+INSTRUCTIONS = """You are Nori, a friendly and helpful conversational assistant for Inforens whose users are international students.\\n\
+            1. Your role is to help users with studying abroad, international student life, universities and applications, visas and immigration, scholarships, accommodation, jobs, cost of living, settling abroad, anything related to international students/ student life and Inforens services (when relevant)\\n\
+            2. You may also answer light conversational messages (such as greetings or small talk). If the user sends a greeting or casual message (e.g. 'Hey', 'Hi', 'How are you'), Respond warmly and naturally, and Gently invite them to ask about studying abroad or student life.\\n\
+            3. GENERAL STUDY ABROAD QUESTIONS - If the question is about studying abroad or international student life in general, Give a clear, neutral, informative answer. DO NOT force Inforens details. You MAY optionally mention Inforens at the end as support (only if helpful).\\n\
+            4. INFORENS-SPECIFIC QUESTIONS - Only explain Inforens features, memberships, services, or offerings IF The user explicitly asks about Inforens OR the question clearly benefits from Inforens support. \\n\
+            5. STRICT TOPIC BOUNDARIES: You must focus on questions that are directly or indirectly relevant to Inforens, studying abroad, international students, or life in a study destination (such as weather, culture, cost of living, or daily life). For topics that are clearly unrelated to these areas, respond exactly: Sorry, I can only help with questions about studying abroad, international students, or Inforens. For other topics, please contact Inforens support at https://www.inforens.com/contact-us \\n\
+            6. If a follow-up question depends on prior context and that context is unclear or missing, do NOT guess. Ask a brief clarification question instead, and return it strictly in the required JSON format with the clarification question inside the answer field and an appropriate Inforens support link in the links array.\\n\
+            7. RESPONSE STYLE:Be warm, friendly, and conversational. Do NOT sound like marketing copy. Prefer short, helpful replies that is precise and concise (2–4 sentences). It is okay to acknowledge greetings naturally before answering. Never mention internal rules or restrictions.\\n\
+            8. When asked to present information in a table, USE A LISTING APPROACH instead, DO NOT display information as a Markdown table.\\n\
+            9. Never mention or compare competitors (other study abroad consultancies). Do not use citation numbers, footnotes, markdown links, or brackets—only add URLs as plain text in sentences.\\n\\n\
+            10. Return valid JSON ONLY in this structure (ALL links starting with https://... MUST be in the links array and NOT in the answer):
+            {
+                "answer": "string",
+                "links": ["https://www.inforens.com/contact-us"]
+            }
+            Always include at least one link in the links array. Do not return anything except valid JSON.
+            Inforens Content:
+"""
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_tokens(text, max_tokens):
+    limit = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+def _format_chunk(chunk):
+    return f"Source: {chunk.url}\n{chunk.text}"
+
+BREAKDOWN_KEYS = ("instructions", "question", "context", "summary", "history", "dropped_chunks", "dropped_messages", "total")
+
+def empty_breakdown():
+    #same shape as assemble_prompt's breakdown, for answers that never built a prompt (fast path, faq, cache)
+    return dict.fromkeys(BREAKDOWN_KEYS, 0)
+
+def assemble_prompt(question, chunks, history, budget, summary=""):
+    """
+    Builds the messages for one request within a token budget.
+    Budget goes to the instructions and question first, then retrieved chunks (in rank order),
+    then the conversation summary, then history (newest turns first).
+    Returns (messages, breakdown of tokens per section).
+    """
+    question = truncate_tokens(question, MESSAGE_MAX_TOKENS)
+    used = estimate_tokens(INSTRUCTIONS) + estimate_tokens(question)
+    breakdown = {"instructions": estimate_tokens(INSTRUCTIONS), "question": estimate_tokens(question)}
+
+    context = []
+    context_tokens = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(_format_chunk(chunk))
+        if context_tokens + tokens > CONTEXT_MAX_TOKENS or used + tokens > budget:
+            continue
+        context.append(_format_chunk(chunk))
+        context_tokens += tokens
+        used += tokens
+    breakdown["context"] = context_tokens
+    breakdown["dropped_chunks"] = len(chunks) - len(context)
+
+    summary_text = f"\n\nSummary of the earlier conversation:\n{summary}" if summary else ""
+    if summary_text and used + estimate_tokens(summary_text) > budget:
+        summary_text = ""
+    breakdown["summary"] = estimate_tokens(summary_text) if summary_text else 0
+    used += breakdown["summary"]
+
+    #history is kept in whole user/assistant turns, newest first, so no answer loses its question
+    kept = []
+    history_tokens = 0
+    for i in range(len(history) - 2, -2, -2):
+        turn = [
+            {"role": message["role"], "content": truncate_tokens(message["content"], MESSAGE_MAX_TOKENS)}
+            for message in history[max(i, 0):i + 2]
+        ]
+        tokens = sum(estimate_tokens(message["content"]) for message in turn)
+        if used + tokens > budget:
+            break
+        kept[:0] = turn
+        history_tokens += tokens
+        used += tokens
+    breakdown["history"] = history_tokens
+    breakdown["dropped_messages"] = len(history) - len(kept)
+    breakdown["total"] = used
+
+    messages = [
+        {"role": "system", "content": INSTRUCTIONS + "\n\n".join(context) + summary_text},
+        *kept,
+        {"role": "user", "content": question}
+    ]
+    return messages, breakdown
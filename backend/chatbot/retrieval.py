@@ -0,0 +1,84 @@
+import re
+from collections import Counter
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could do does for from had has have hello hey hi how i if in into is it
+its me my of on or our so than that the their them then there these they this to up us was we were
+what when where which who why will with would you your
+""".split())
+
+def tokenize(text):
+    #lowercase word tokens without stopwords, with a light plural strip (visas -> visa)
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class BM25Index:
+    """Chunk x term sparse matrix of BM25 tf-idf weights, a question is scored with one matrix-vector product."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = tuple(chunks)
+        self.vocabulary = {}
+
+        #CSR layout: row i owns indices[indptr[i]:indptr[i + 1]]
+        indptr = [0]
+        indices = []
+        term_freqs = []
+        for chunk in self.chunks:
+            for term, tf in Counter(tokenize(chunk.text)).items():
+                indices.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                term_freqs.append(tf)
+            indptr.append(len(indices))
+
+        n = len(self.chunks)
+        self.indices = np.array(indices, dtype=np.int32)
+        self.row_ids = np.repeat(np.arange(n, dtype=np.int32), np.diff(indptr))
+        tf = np.array(term_freqs, dtype=np.float32)
+
+        lengths = np.bincount(self.row_ids, weights=tf, minlength=n)
+        avgdl = lengths.mean() if n else 1.0
+        doc_freq = np.bincount(self.indices, minlength=len(self.vocabulary))
+        idf = np.log1p((n - doc_freq + 0.5) / (doc_freq + 0.5))
+        length_norm = k1 * (1 - b + b * lengths / avgdl)
+
+        self.data = (idf[self.indices] * tf * (k1 + 1) / (tf + length_norm[self.row_ids])).astype(np.float32)
+
+    @classmethod
+    def from_arrays(cls, chunks, vocabulary, indices, row_ids, data):
+        #rebuild around precomputed (e.g. memory mapped) arrays without re-tokenizing the corpus
+        index = cls.__new__(cls)
+        index.chunks = chunks
+        index.vocabulary = vocabulary
+        index.indices = indices
+        index.row_ids = row_ids
+        index.data = data
+        return index
+
+    def _query_vector(self, question):
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for term in tokenize(question):
+            col = self.vocabulary.get(term)
+            if col is not None:
+                query[col] = 1.0
+        return query
+
+    def scores(self, question):
+        query = self._query_vector(question)
+        return np.bincount(self.row_ids, weights=self.data * query[self.indices], minlength=len(self.chunks))
+
+    def search(self, question, k=5):
+        if not self.chunks:
+            return []
+
+        scores = self.scores(question)
+        top = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.chunks[i], float(scores[i])) for i in top if scores[i] > 0]
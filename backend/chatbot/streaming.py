@@ -0,0 +1,74 @@
+import re
+
+ANSWER_START = re.compile(r'"answer"\s*:\s*"')
+PARTIAL_CITATION = re.compile(r"\[\d*$") #a "[12" that may still become a "[12]" citation mark
+CITATION = re.compile(r"\[\d+\]")
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class AnswerStream:
+    """Pulls the "answer" string out of a JSON object while the model is still generating it."""
+
+    def __init__(self):
+        self.raw = ""
+        self.pos = None #index in raw of the next undecoded answer character
+        self.done = False
+        self._held = "" #text held back until we know whether it is a citation mark
+
+    def feed(self, text):
+        #returns the newly decoded answer text (may be empty)
+        self.raw += text
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = ANSWER_START.search(self.raw)
+            if not match:
+                return ""
+            self.pos = match.end()
+        return self._strip_citations(self._decode())
+
+    def _decode(self):
+        raw = self.raw
+        out = []
+        i = self.pos
+        while i < len(raw):
+            ch = raw[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+
+            #escape sequence, wait for more input if it is cut off
+            if i + 1 >= len(raw):
+                break
+            if raw[i + 1] != "u":
+                out.append(ESCAPES.get(raw[i + 1], raw[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(raw):
+                break
+            code = int(raw[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00: #high surrogate, needs the following \uXXXX low surrogate
+                if i + 12 > len(raw):
+                    break
+                low = int(raw[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+                continue
+            out.append(chr(code))
+            i += 6
+        self.pos = i
+        return "".join(out)
+
+    def _strip_citations(self, text):
+        text = CITATION.sub("", self._held + text)
+        self._held = ""
+        if not self.done:
+            partial = PARTIAL_CITATION.search(text)
+            if partial:
+                self._held = text[partial.start():]
+                text = text[:partial.start()]
+        return text
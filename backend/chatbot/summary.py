@@ -0,0 +1,35 @@
+import re
+from collections import Counter
+from chatbot.retrieval import tokenize
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+QUESTION_MAX_CHARS = 160
+SUMMARY_MAX_CHARS = 1200 #oldest summary lines are dropped beyond this
+
+def _key_sentence(text, weights):
+    #the answer sentence whose words are most frequent across the conversation
+    sentences = [s.strip() for s in SENTENCE_SPLIT.split(text) if s.strip()]
+    if not sentences:
+        return ""
+    return max(sentences, key=lambda s: sum(weights[t] for t in set(tokenize(s))) / (1 + len(s) / 200))
+
+def _shorten(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+def summarize_turns(summary, messages):
+    """Local extractive summary: one line per user question and the key sentence of each answer."""
+    weights = Counter(t for message in messages for t in tokenize(message["content"]))
+
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        if message["role"] == "user":
+            lines.append(f"User asked: {_shorten(message['content'], QUESTION_MAX_CHARS)}")
+        else:
+            sentence = _key_sentence(message["content"], weights)
+            if sentence:
+                lines.append(f"Nori answered: {_shorten(sentence, QUESTION_MAX_CHARS * 2)}")
+
+    while len(lines) > 1 and sum(len(line) + 1 for line in lines) > SUMMARY_MAX_CHARS:
+        lines.pop(0)
+    return "\n".join(lines)
@@ -1,8 +1,10 @@
 #call perplexity
 import requests
 import os
+import llm_client
 from dotenv import load_dotenv
 import json
+from llm_json import JSONExtractionError, extract_json_object
 
 load_dotenv()
 PERPLEXITY_API_KEY = os.getenv("CV_BUILDER_API_KEY", "").strip()
@@ -114,12 +116,6 @@ CV_JSON_SCHEMA = {
 }
 
 def call_perplexity(prompt):
-    url = "https://api.perplexity.ai/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "model": "sonar",
         "messages": [
@@ -131,7 +127,10 @@ def call_perplexity(prompt):
         }    
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    try:
+        response = llm_client.chat_completion(PERPLEXITY_API_KEY, payload, endpoint="generation")
+    except requests.exceptions.RequestException:
+        raise Exception("LLM_UNAVAILABLE")
 
     #not able to reach
     if response.status_code != 200:
@@ -150,10 +149,10 @@ def call_perplexity(prompt):
     if not content or not content.strip():
         raise Exception("EMPTY_MODEL_RESPONSE")
 
-    #invalid JSON
+    #invalid JSON (fences and text around the object are tolerated), returned as plain JSON for the callers
     try:
-        json.loads(content)
-    except Exception:
-        raise Exception("INVALID_MODEL_OUTPUT")
+        cv = extract_json_object(content)
+    except JSONExtractionError as e:
+        raise Exception("INVALID_MODEL_OUTPUT") from e
 
-    return content
\ No newline at end of file
+    return json.dumps(cv, ensure_ascii=False)
\ No newline at end of file
@@ -1,39 +1,59 @@
-import re
+import hashlib
 from docx import Document
-import pdfplumber
+from cv_builder import pdf_text
 from cv_builder.generate_cv import call_perplexity
+from llm_json import extract_json_object
 
-#extract text from pdf
-def extract_info_from_pdf(file_path):
-    with pdfplumber.open(file_path) as pdf:
-        text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-    return extract_json_object(extract_info_from_text(text))
+#text hashes are only trusted from this many characters on, scanned pdfs without a text layer all extract to ""
+MIN_HASHED_TEXT_CHARS = 200
+HASH_CHUNK_BYTES = 64 * 1024
 
-#extract text from doc
-def extract_info_from_docx(file_path):
-    doc = Document(file_path)
-    text = "\n".join(p.text for p in doc.paragraphs)
-    return extract_json_object(extract_info_from_text(text))
+#sha-256 of the uploaded bytes, the same file uploaded again is recognised before it is even parsed
+def file_hash(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    stream.seek(0) #read again by the extractor
+    return digest.hexdigest()
+
+#sha-256 of the extracted text with whitespace collapsed, catches the same cv exported again; None if too little text
+def text_hash(text):
+    normalized = " ".join(text.split())
+    if len(normalized) < MIN_HASHED_TEXT_CHARS:
+        return None
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class TooManyPages(ValueError):
+    """The pdf has more pages than the caller accepts."""
 
-def extract_json_object(text):
-    text = re.sub(r'^`{3,}\w*\s*', '', text)
-    text = re.sub(r'`{3,}\s*$', '', text)
+#plain text of a pdf, from a path or a binary file object; engine is one of pdf_text.ENGINES
+def extract_text_from_pdf(source, max_pages=None, engine=pdf_text.DEFAULT_ENGINE, parallel_pages=pdf_text.PARALLEL_PAGES):
+    if hasattr(source, "read"):
+        data = source.read()
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    pages = pdf_text.page_count(data)
+    if max_pages is not None and pages > max_pages:
+        raise TooManyPages(f"pdf has {pages} pages, at most {max_pages} are accepted")
+    return pdf_text.extract_text(data, engine, pages, parallel_pages)
+
+#plain text of a docx, from a path or a binary file object
+def extract_text_from_docx(source):
+    doc = Document(source)
+    return "\n".join(p.text for p in doc.paragraphs)
+
+#parsed cv fields from the extracted text (raises llm_json.JSONExtractionError)
+def parse_cv_text(text):
+    return extract_json_object(extract_info_from_text(text))
 
-    start = text.find('{')
-    if start == -1:
-        return None  
+#extract text from pdf (path or binary file object), returns the parsed cv fields (raises llm_json.JSONExtractionError)
+def extract_info_from_pdf(source, max_pages=None):
+    return parse_cv_text(extract_text_from_pdf(source, max_pages))
 
-    depth = 0
-    for i in range(start, len(text)):
-        if text[i] == '{':
-            depth += 1
-        elif text[i] == '}':
-            depth -= 1
-            if depth == 0:
-                end = i + 1
-                json_str = text[start:end]
-                return json_str
-    return None
+#extract text from doc (path or binary file object)
+def extract_info_from_docx(source):
+    return parse_cv_text(extract_text_from_docx(source))
 
 #extract required data from extracted text
 def extract_info_from_text(text):
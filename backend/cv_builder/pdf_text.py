@@ -0,0 +1,104 @@
+import io
+import math
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pdfplumber
+import pypdfium2 as pdfium
+
+#pdf text extraction for cv uploads: pdfium's text layer by default, pdfplumber's layout analysis only when that looks wrong
+
+DEFAULT_ENGINE = "pdfium"
+PARALLEL_PAGES = 0 #documents with at least this many pages are split across worker processes, 0 never splits;
+#off by default: a cv within the upload page cap is extracted in process faster than the pool's round trip,
+#the pool only pays off when CV_UPLOAD_MAX_PAGES is raised to allow documents of dozens of pages
+WORKERS = min(4, os.cpu_count() or 1)
+MIN_CHARS_PER_PAGE = 40 #less text than this per page means pdfium missed the text, try pdfplumber
+MAX_BAD_CHAR_RATIO = 0.05 #more replacement or control characters than this means garbled text (broken font encodings)
+_BAD_CHARS = re.compile(r"[\ufffd\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_pdfium_lock = threading.Lock() #pdfium is not thread safe, calls from request threads take turns
+_pool = None
+_pool_lock = threading.Lock()
+
+def _pdfium_pages(data, start, stop):
+    #text of pages start to stop - 1, in a request thread (under _pdfium_lock) or in a worker process
+    pdf = pdfium.PdfDocument(data)
+    try:
+        texts = []
+        for index in range(start, min(stop, len(pdf))):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_bounded().replace("\r\n", "\n"))
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            #spawned rather than forked, a fork would copy the app's background threads and locks mid-use
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def page_count(data):
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(data)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def pdfium_text(data, pages, parallel_pages=PARALLEL_PAGES):
+    #page texts; large documents are extracted in parallel, a chunk of pages per worker process
+    if parallel_pages and pages >= parallel_pages and WORKERS > 1:
+        chunk = math.ceil(pages / WORKERS)
+        try:
+            futures = [_get_pool().submit(_pdfium_pages, data, start, start + chunk) for start in range(0, pages, chunk)]
+            return [text for future in futures for text in future.result()]
+        except BrokenProcessPool as e:
+            #a worker died (e.g. killed for memory): start a new pool next time, extract this one here
+            print(f"PDF worker pool broke, extracting in process: {e}")
+            _reset_pool()
+    with _pdfium_lock:
+        return _pdfium_pages(data, 0, pages)
+
+def pdfplumber_text(data, pages, parallel_pages=None):
+    #slow: full layout analysis in python, always in process
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages[:pages]]
+
+ENGINES = {"pdfium": pdfium_text, "pdfplumber": pdfplumber_text}
+
+def looks_wrong(text, pages):
+    #too little text for the page count, or text full of characters no cv contains
+    stripped = "".join(text.split())
+    if len(stripped) < MIN_CHARS_PER_PAGE * pages:
+        return True
+    return len(_BAD_CHARS.findall(stripped)) > MAX_BAD_CHAR_RATIO * len(stripped)
+
+def extract_text(data, engine=DEFAULT_ENGINE, pages=None, parallel_pages=PARALLEL_PAGES):
+    """Text of the first pages pages of a pdf given as bytes; pdfium results that look wrong are redone with pdfplumber."""
+    if engine not in ENGINES:
+        raise ValueError(f"unknown pdf engine {engine}, expected one of {', '.join(ENGINES)}")
+    if pages is None:
+        pages = page_count(data)
+    text = "\n".join(ENGINES[engine](data, pages, parallel_pages))
+    if engine != "pdfplumber" and pages and looks_wrong(text, pages):
+        fallback = "\n".join(pdfplumber_text(data, pages))
+        if len(fallback.strip()) > len(text.strip()):
+            return fallback
+    return text
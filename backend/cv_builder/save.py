@@ -1,4 +1,3 @@
-import json
 from docx import Document
 from docx.shared import Pt, Inches, RGBColor
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT, WD_TAB_ALIGNMENT
@@ -6,6 +5,7 @@ from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 import re
 from datetime import datetime
+from llm_json import JSONExtractionError, extract_json_object
 
 
 def add_markdown_text(paragraph, text):
@@ -161,9 +161,9 @@ def save_as_docx(text, filename="generated_cv.docx"):
     style.paragraph_format.space_after = Pt(4)
 
     try:
-        data = json.loads(text)
+        data = extract_json_object(text)
         is_json = True
-    except:
+    except JSONExtractionError:
         is_json = False
 
     if not is_json:
@@ -1,5 +1,80 @@
+import threading
+import time
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import QueuePool
 db = SQLAlchemy()
 
+SLOW_WAIT_SECONDS = 0.1 #checkouts slower than this are counted separately
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited (for a free connection or a new one)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.slow_waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                if waited >= SLOW_WAIT_SECONDS:
+                    self.slow_waits += 1
+
+def engine_options(config):
+    #pool and connection settings from app.config, the pool is per worker process
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"], #managed postgres drops idle connections
+        "pool_pre_ping": config["DB_POOL_PRE_PING"], #checks a connection before handing it out
+    }
+    uri = config.get("SQLALCHEMY_DATABASE_URI") or ""
+    if uri.startswith("postgresql"):
+        connect_args = {
+            "connect_timeout": config["DB_CONNECT_TIMEOUT"],
+            "options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}",
+        }
+        if uri.startswith("postgresql+psycopg:"):
+            #psycopg 3 prepares a statement server side after this many executions on a connection;
+            #None turns it off, which is needed behind pgbouncer in transaction mode
+            connect_args["prepare_threshold"] = config["DB_PREPARE_THRESHOLD"]
+        options["connect_args"] = connect_args
+    return options
+
+def pool_stats():
+    #needs an app context; wait times tell database connection waits apart from LLM latency
+    pool = db.engine.pool
+    stats = {"status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "waits": pool.waits,
+                "slow_waits": pool.slow_waits,
+                "avg_wait_ms": round(1000 * pool.wait_seconds / pool.waits, 2) if pool.waits else 0.0,
+                "max_wait_ms": round(1000 * pool.max_wait_seconds, 2),
+            })
+    return stats
+
 def init_db(app):
+    if app.config.get("DB_POOL_SIZE") is not None:
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
     db.init_app(app)
@@ -1,6 +1,76 @@
-from app import app  
+from app import app
 from db import db
+from sqlalchemy import inspect, text
+from partitions import ensure_partitions
+
+def _index_body(index):
+    #"(columns) WHERE ..." of a model index, compiled for postgres
+    compiler = db.engine.dialect.ddl_compiler(db.engine.dialect, None).sql_compiler
+    columns = ", ".join(compiler.process(expr, include_table=False, literal_binds=True) for expr in index.expressions)
+    where = index.dialect_options["postgresql"]["where"]
+    if where is None:
+        return f"({columns})"
+    return f"({columns}) WHERE {compiler.process(where, include_table=False, literal_binds=True)}"
+
+def _create_index_concurrently(connection, index):
+    #CREATE INDEX CONCURRENTLY only blocks schema changes, writes to the live table go on while it builds
+    table = index.table.name
+    unique = "UNIQUE " if index.unique else ""
+    body = _index_body(index)
+    valid = connection.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": index.name}).scalar()
+    if valid:
+        return
+    partitioned = connection.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"), {"table": table}
+    ).scalar()
+    if not partitioned:
+        if valid is False:
+            #left invalid by a build that failed halfway, IF NOT EXISTS would keep it forever
+            connection.execute(text(f'DROP INDEX CONCURRENTLY "{index.name}"'))
+        connection.execute(text(f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS "{index.name}" ON "{table}" {body}'))
+        return
+
+    #a partitioned table takes no concurrent index: the parent index is created empty (ON ONLY, invalid),
+    #each partition is indexed concurrently and attached, and the parent becomes valid with the last one
+    connection.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS "{index.name}" ON ONLY "{table}" {body}'))
+    attached = set(connection.execute(text(
+        "SELECT t.relname FROM pg_inherits i JOIN pg_index x ON x.indexrelid = i.inhrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE i.inhparent = to_regclass(:name)"
+    ), {"name": index.name}).scalars())
+    partitions = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": table}).scalars().all()
+    for partition in partitions:
+        if partition in attached:
+            continue
+        name = f"{index.name}_{partition}"
+        connection.execute(text(f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{partition}" {body}'))
+        connection.execute(text(f'ALTER INDEX "{index.name}" ATTACH PARTITION "{name}"'))
 
 with app.app_context():
     db.create_all()
-    print("All tables created successfully.")
\ No newline at end of file
+    #create_all skips tables that already exist, so nullable columns added to a model later are added here
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+    db.session.commit()
+    #and the same for indexes
+    if db.engine.dialect.name == "postgresql":
+        #concurrent builds can not run inside a transaction, and may take longer than the engine wide statement_timeout
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("SET statement_timeout = 0"))
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    _create_index_concurrently(connection, index)
+    else:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+    print("All tables created successfully.")
+
+#a new queries table starts without partitions, an existing plain one is converted with python partitions.py convert
+ensure_partitions(app, app.config['QUERY_PARTITION_MONTHS_AHEAD'])
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+#every feature talks to Perplexity through this module so connections (and TLS sessions) are reused
+ENDPOINTS = {
+    #name: (url, (connect timeout, read timeout) in seconds)
+    "chat": ("https://api.perplexity.ai/chat/completions", (5, 30)),
+    #long structured documents (cv, sop) with no max_tokens can take minutes; own breaker, slow runs never trip chat's
+    "generation": ("https://api.perplexity.ai/chat/completions", (5, 180)),
+    "transcription": ("https://api.perplexity.ai/audio/transcriptions", (5, 60)),
+}
+
+POOL_SIZE = 20 #keep-alive connections per host, should cover the worker's thread count
+MAX_RETRIES = 2 #extra attempts after the first one
+BACKOFF_SECONDS = 0.25 #base for exponential backoff with full jitter
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_RETRY_AFTER = 10 #longest Retry-After (seconds) a 429 is waited out for, longer ones are returned to the caller
+BREAKER_FAILURES = 5 #consecutive failures that open the circuit
+BREAKER_COOLDOWN = 30 #seconds the circuit stays open before a trial request is let through
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                #half open: let this request through, one more failure re-opens the circuit
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+def _never_sent(error):
+    #true only when the connection could not be opened; a reset or disconnect after that may come after
+    #upstream received the body, and a retry would run (and bill) the same call twice
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    return isinstance(cause, NewConnectionError) or isinstance(getattr(cause, "reason", None), NewConnectionError)
+
+def _retry_after(response, attempt):
+    #seconds to wait before retrying a 429: upstream's Retry-After (seconds or an HTTP date), else the usual backoff
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, BACKOFF_SECONDS * 2 ** attempt)
+
+class LLMClient:
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINTS), pool_maxsize=POOL_SIZE, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.breakers = {name: CircuitBreaker() for name in ENDPOINTS}
+
+    def post(self, endpoint, api_key, timeout=None, **kwargs):
+        """POST to a named endpoint with retries; the final response is returned whatever its status."""
+        url, default_timeout = ENDPOINTS[endpoint]
+        breaker = self.breakers[endpoint]
+        headers = {"Authorization": f"Bearer {api_key}"}
+
+        for attempt in range(MAX_RETRIES + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"{endpoint} circuit is open, skipping upstream call")
+
+            last_attempt = attempt == MAX_RETRIES
+            delay = random.uniform(0, BACKOFF_SECONDS * 2 ** attempt)
+            try:
+                response = self.session.post(url, headers=headers, timeout=timeout or default_timeout, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                breaker.record_failure()
+                #only a connection that was never opened is safe to try again
+                if last_attempt or not _never_sent(e):
+                    raise
+            except requests.exceptions.RequestException:
+                #read timeouts are not retried, upstream may still be working on the first request
+                breaker.record_failure()
+                raise
+            else:
+                if response.status_code == 429:
+                    #rate limited: upstream is healthy, so the breaker shared by every feature is left alone
+                    delay = _retry_after(response, attempt)
+                    if last_attempt or delay > MAX_RETRY_AFTER:
+                        return response
+                elif response.status_code < 500:
+                    breaker.record_success()
+                    return response
+                else:
+                    breaker.record_failure()
+                    if last_attempt or response.status_code not in RETRY_STATUSES:
+                        return response
+                response.close()
+
+            time.sleep(delay)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of fn and all receive its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            #forget the key first, requests arriving after this point start a fresh call
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+_client = None
+_client_lock = threading.Lock()
+_inflight = SingleFlight()
+
+def get_client():
+    #created lazily so every gunicorn worker builds its own pool after fork
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+def chat_completion(api_key, payload, timeout=None, stream=False, endpoint="chat"):
+    return get_client().post(endpoint, api_key, json=payload, timeout=timeout, stream=stream)
+
+def coalesced_chat_completion(api_key, payload, timeout=None, endpoint="chat"):
+    """chat_completion where identical in-flight requests (same key and fully rendered payload) share one upstream call."""
+    rendered = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    key = hashlib.sha256(f"{api_key}\n{rendered}".encode("utf-8")).hexdigest()
+
+    def call():
+        response = chat_completion(api_key, payload, timeout=timeout, endpoint=endpoint)
+        response.content #read the body now so every waiter can call .json() on the shared response
+        return response
+
+    return _inflight.do(key, call)
+
+def transcribe(api_key, files):
+    return get_client().post("transcription", api_key, files=files)
@@ -0,0 +1,86 @@
+import json
+import re
+
+#every feature parses model output through this module, so the same repairs and errors apply everywhere
+
+class JSONExtractionError(ValueError):
+    """Model output could not be turned into the expected JSON object."""
+
+class NoJSONFound(JSONExtractionError):
+    """There is no "{" in the output at all (empty reply, plain text answer)."""
+
+class MalformedJSON(JSONExtractionError):
+    """An object starts in the output but does not parse, even after repairs (e.g. truncated reply)."""
+
+class UnexpectedJSON(JSONExtractionError):
+    """The output parsed, but is missing keys the caller needs."""
+
+_decoder = json.JSONDecoder()
+_STRUCTURE = re.compile(r'[{}\[\]"]') #the only characters that matter when looking for the end of an object
+_STRING_END = re.compile(r'\\.|"', re.DOTALL)
+#strings are matched first so commas inside them are left alone
+_TRAILING_COMMA = re.compile(r'"(?:\\.|[^"\\])*"|,(\s*[}\]])', re.DOTALL)
+
+def _object_end(text, start):
+    #index just past the bracket closing the one at start, skipping over strings; None if the text ends first
+    depth = 0
+    pos = start
+    while True:
+        match = _STRUCTURE.search(text, pos)
+        if match is None:
+            return None
+        pos = match.end()
+        char = match.group()
+        if char == '"':
+            while True:
+                end = _STRING_END.search(text, pos)
+                if end is None:
+                    return None
+                pos = end.end()
+                if end.group() == '"':
+                    break
+            continue
+        depth += 1 if char in "{[" else -1
+        if depth == 0:
+            return pos
+
+def repair(text):
+    #trailing commas are the one mistake models make often that is always safe to fix
+    return _TRAILING_COMMA.sub(lambda m: m.group(1) if m.group(1) is not None else m.group(0), text)
+
+def extract_json_object(text):
+    """The first JSON object in text (code fences and chatter around it are skipped), as a dict."""
+    if not text:
+        raise NoJSONFound("empty output")
+
+    start = text.find("{")
+    if start == -1:
+        raise NoJSONFound("no JSON object in output")
+
+    while True:
+        try:
+            return _decoder.raw_decode(text, start)[0] #C scanner, stops at the end of the object
+        except json.JSONDecodeError as e:
+            error = e
+
+        end = _object_end(text, start)
+        if end is None:
+            break #truncated, nothing after this point can be a complete object either
+        try:
+            return json.loads(repair(text[start:end]))
+        except json.JSONDecodeError as e:
+            error = e
+
+        #not an object after all (e.g. "{name}" in prose), try the next one
+        start = text.find("{", end)
+        if start == -1:
+            break
+    raise MalformedJSON(f"JSON object could not be parsed: {error}")
+
+def parse_json_object(text, required=()):
+    #extract_json_object plus a check for the keys the caller relies on
+    value = extract_json_object(text)
+    missing = [key for key in required if key not in value]
+    if missing:
+        raise UnexpectedJSON(f"JSON object is missing {', '.join(missing)}")
+    return value
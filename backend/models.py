@@ -4,8 +4,10 @@ from sqlalchemy.dialects.postgresql import JSONB
 class Query(db.Model):
     __tablename__ = "queries"
 
-    id = db.Column(db.BigInteger, primary_key=True)
-    asked_at = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now(), nullable=False)
+    #ids come from this sequence (query_log.IdAllocator reserves them); sqlite has no sequences and ignores it
+    id = db.Column(db.BigInteger, db.Sequence("queries_id_seq"), primary_key=True)
+    #part of the key because postgres requires the partition column in it (monthly partitions, see partitions.py)
+    asked_at = db.Column(db.TIMESTAMP(timezone=True), primary_key=True, server_default=db.func.now(), nullable=False)
     session_id = db.Column(db.Text, nullable=True)
     user_id = db.Column(db.Text, nullable=True)
     question = db.Column(db.Text, nullable=False)
@@ -19,6 +21,31 @@ class Query(db.Model):
     thumbs_up = db.Column(db.Boolean, default=False)
     thumbs_down = db.Column(db.Boolean, default=False)
     feedback = db.Column(db.Text, nullable=True)
+    prompt_tokens = db.Column(db.JSON, nullable=True) #estimated tokens per prompt section, all 0 when no prompt was built
+
+    __table_args__ = (
+        db.Index("ix_queries_asked_at", "asked_at"),
+        db.Index("ix_queries_session_asked_at", "session_id", "asked_at"),
+        #partial indexes: failures and feedback are a small slice of all rows
+        db.Index("ix_queries_failed_asked_at", "asked_at", postgresql_where=db.text("success IS NOT TRUE")),
+        db.Index("ix_queries_thumbs_up_asked_at", "asked_at", postgresql_where=db.text("thumbs_up")),
+        db.Index("ix_queries_thumbs_down_asked_at", "asked_at", postgresql_where=db.text("thumbs_down")),
+        db.Index("ix_queries_feedback_asked_at", "asked_at", postgresql_where=db.text("feedback IS NOT NULL AND feedback <> ''")),
+        {"postgresql_partition_by": "RANGE (asked_at)"},
+    )
+
+class QueryRollup(db.Model):
+    __tablename__ = "query_rollups_hourly"
+
+    hour = db.Column(db.TIMESTAMP(timezone=True), primary_key=True) #start of the hour, UTC
+    count = db.Column(db.Integer, nullable=False)
+    successes = db.Column(db.Integer, nullable=False)
+    p50_latency_ms = db.Column(db.Float, nullable=True)
+    p95_latency_ms = db.Column(db.Float, nullable=True)
+    p99_latency_ms = db.Column(db.Float, nullable=True)
+    thumbs_up = db.Column(db.Integer, nullable=False)
+    thumbs_down = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now(), nullable=False)
 
 class CVUpload(db.Model):
     __tablename__ = "cv_uploads"
@@ -27,4 +54,15 @@ class CVUpload(db.Model):
     uploaded_at = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now(), nullable=False)
     session_id = db.Column(db.Text, nullable=True)
     user_id = db.Column(db.Text, nullable=True)
-    json_response = db.Column(JSONB, nullable=False)
\ No newline at end of file
+    json_response = db.Column(JSONB, nullable=False)
+    #repeat uploads of the same cv reuse json_response instead of another LLM parse
+    file_sha256 = db.Column(db.Text, nullable=True, index=True)
+    text_sha256 = db.Column(db.Text, nullable=True, index=True)
+
+class ChatSession(db.Model):
+    __tablename__ = "chat_sessions"
+
+    session_id = db.Column(db.Text, primary_key=True)
+    summary = db.Column(db.Text, nullable=True)
+    history = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.TIMESTAMP(timezone=True), server_default=db.func.now(), nullable=False, index=True)
@@ -0,0 +1,257 @@
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import text
+from models import db, Query
+
+#queries is range partitioned by month on asked_at: old months are archived to files and detached, not deleted row by row
+
+MONTHS_AHEAD = 2 #partitions created ahead of time, so inserts never hit a missing month
+ARCHIVE_AFTER_MONTHS = 12 #months kept in postgres, older partitions are archived
+EXPORT_BATCH = 5000 #rows fetched per round trip while exporting
+PARTITION_LOCK_ID = 7243002 #postgres advisory lock, only one worker maintains partitions at a time
+PARTITION_NAME = re.compile(r"^queries_(\d{4})_(\d{2})$")
+ARCHIVE_FORMATS = ("ndjson", "parquet")
+DEFAULT_PARTITION = "queries_default"
+
+class PartitionError(RuntimeError):
+    """Partition maintenance can not run against this database or with these settings."""
+
+def _month_start(value):
+    value = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+def _add_months(month, months):
+    year, index = divmod(month.month - 1 + months, 12)
+    return datetime(month.year + year, index + 1, 1, tzinfo=timezone.utc)
+
+def partition_name(month):
+    return f"queries_{month:%Y_%m}"
+
+def _is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+def is_partitioned():
+    return bool(db.session.execute(
+        text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('queries'))")
+    ).scalar())
+
+def existing_partitions():
+    #{month: name} for the monthly partitions currently attached to queries
+    rows = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('queries')"
+    ))
+    partitions = {}
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)] = name
+    return partitions
+
+def _ensure_default_partition():
+    #catches rows for months nobody created a partition for (maintenance off or failing), instead of failing the insert
+    if db.session.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}')")).scalar() is None:
+        db.session.execute(text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF queries DEFAULT'))
+
+def _create_partition(month):
+    #bounds are inlined: partition bounds and CREATE TABLE AS take no bind parameters
+    bounds = f"asked_at >= '{month.isoformat()}' AND asked_at < '{_add_months(month, 1).isoformat()}'"
+    stray = db.session.execute(text(f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE {bounds})')).scalar()
+    if stray:
+        #postgres refuses a new partition while the default one holds rows of its range: move them over
+        db.session.execute(text(f'CREATE TEMPORARY TABLE queries_moved AS SELECT * FROM "{DEFAULT_PARTITION}" WHERE {bounds}'))
+        db.session.execute(text(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE {bounds}'))
+    name = partition_name(month)
+    db.session.execute(text(
+        f'CREATE TABLE "{name}" PARTITION OF queries '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    ))
+    if stray:
+        db.session.execute(text("INSERT INTO queries SELECT * FROM queries_moved"))
+        db.session.execute(text("DROP TABLE queries_moved"))
+    return name
+
+def _create_partitions(first, last):
+    #every missing month from first to last, both included, plus the default partition and
+    #the months of any rows that landed in it, so those rows get archived with their month later
+    _ensure_default_partition()
+    existing = existing_partitions()
+    months = set()
+    month = first
+    while month <= last:
+        months.add(month)
+        month = _add_months(month, 1)
+    stray = db.session.execute(text(f"SELECT DISTINCT date_trunc('month', asked_at, 'UTC') FROM \"{DEFAULT_PARTITION}\""))
+    months.update(_month_start(row[0]) for row in stray)
+    return [_create_partition(month) for month in sorted(months) if month not in existing]
+
+def _lock():
+    return db.session.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID}).scalar()
+
+def ensure_partitions(app, months_ahead=MONTHS_AHEAD, now=None):
+    """Create the partitions for this month and the next months_ahead months; returns the names created."""
+    now = now or datetime.now(timezone.utc)
+    with app.app_context():
+        if not _is_postgres() or not is_partitioned():
+            return [] #sqlite in development, or a database that has not been converted yet
+        if not _lock():
+            db.session.rollback()
+            return [] #another worker is on it
+        month = _month_start(now)
+        created = _create_partitions(month, _add_months(month, months_ahead))
+        db.session.commit()
+        return created
+
+def convert_to_partitioned(app, months_ahead=MONTHS_AHEAD, now=None):
+    """One-off migration of an existing plain queries table to the partitioned layout, in a single transaction."""
+    now = now or datetime.now(timezone.utc)
+    with app.app_context():
+        if not _is_postgres():
+            raise PartitionError("table partitioning needs postgres")
+        if is_partitioned():
+            return False
+        if db.session.execute(text("SELECT to_regclass('queries')")).scalar() is None:
+            raise PartitionError("queries does not exist, run initialisation.py instead")
+
+        #the copy below takes as long as the table is big, the engine wide statement_timeout must not cut it off
+        db.session.execute(text("SET LOCAL statement_timeout = 0"))
+        #the old table, its key, sequence and indexes make way for the new ones
+        db.session.execute(text("LOCK TABLE queries IN ACCESS EXCLUSIVE MODE"))
+        sequence = db.session.execute(text("SELECT pg_get_serial_sequence('queries', 'id')")).scalar()
+        db.session.execute(text("ALTER TABLE queries RENAME TO queries_unpartitioned"))
+        db.session.execute(text("ALTER TABLE queries_unpartitioned RENAME CONSTRAINT queries_pkey TO queries_unpartitioned_pkey"))
+        if sequence:
+            db.session.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO queries_unpartitioned_id_seq"))
+        for index in Query.__table__.indexes:
+            db.session.execute(text(f'DROP INDEX IF EXISTS "{index.name}"'))
+
+        connection = db.session.connection()
+        Query.__table__.create(connection) #creates a fresh queries_id_seq too
+        first = db.session.execute(text("SELECT min(asked_at) FROM queries_unpartitioned")).scalar()
+        month = _month_start(now)
+        _create_partitions(_month_start(first) if first else month, _add_months(month, months_ahead))
+
+        columns = ", ".join(f'"{column.name}"' for column in Query.__table__.columns)
+        moved = db.session.execute(text(f"INSERT INTO queries ({columns}) SELECT {columns} FROM queries_unpartitioned")).rowcount
+        #new ids continue after the old sequence, ids workers reserved but have not written yet stay unique
+        last = db.session.execute(text("SELECT max(id) FROM queries")).scalar() or 0
+        if sequence:
+            last = max(last, db.session.execute(text("SELECT last_value FROM queries_unpartitioned_id_seq")).scalar())
+        db.session.execute(text("SELECT setval('queries_id_seq', :last, :called)"),
+                           {"last": max(last, 1), "called": last > 0})
+        db.session.execute(text("DROP TABLE queries_unpartitioned"))
+        db.session.commit()
+        return moved
+
+def _export_ndjson(name, path):
+    rows = db.session.execute(
+        text(f'SELECT * FROM "{name}" ORDER BY id').execution_options(stream_results=True, yield_per=EXPORT_BATCH)
+    )
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(dict(row._mapping), default=lambda value: value.isoformat(), ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+def _export_parquet(name, path):
+    import pandas as pd
+    try:
+        frame = pd.read_sql(text(f'SELECT * FROM "{name}" ORDER BY id'), db.session.connection())
+        frame.to_parquet(path, index=False)
+    except ImportError as e:
+        raise PartitionError(f"parquet archives need pyarrow installed: {e}") from e
+    return len(frame)
+
+def export_partition(name, directory, fmt="ndjson"):
+    """Write one partition to directory as name.ndjson.gz or name.parquet; returns (path, rows)."""
+    if fmt not in ARCHIVE_FORMATS:
+        raise PartitionError(f"unknown archive format {fmt}, expected one of {', '.join(ARCHIVE_FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.ndjson.gz" if fmt == "ndjson" else f"{name}.parquet")
+    tmp_path = f"{path}.tmp"
+    try:
+        count = _export_ndjson(name, tmp_path) if fmt == "ndjson" else _export_parquet(name, tmp_path)
+        #the partition is only detached once its archive is complete on disk
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, count
+
+def archive_partitions(app, directory, older_than_months=ARCHIVE_AFTER_MONTHS, fmt="ndjson", drop=False, now=None):
+    """Export every partition entirely older than older_than_months, then detach it (and drop it if drop); returns archived paths."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = _add_months(_month_start(now), -older_than_months)
+    archived = []
+    with app.app_context():
+        if not _is_postgres() or not is_partitioned():
+            return archived
+        if not _lock():
+            db.session.rollback()
+            return archived
+        for month, name in sorted(existing_partitions().items()):
+            if _add_months(month, 1) > cutoff:
+                break
+            path, count = export_partition(name, directory, fmt)
+            db.session.execute(text(f'ALTER TABLE queries DETACH PARTITION "{name}"'))
+            if drop:
+                db.session.execute(text(f'DROP TABLE "{name}"'))
+            #committed per partition, an error later on keeps the months already archived
+            db.session.commit()
+            app.logger.info("archived %s rows of %s to %s", count, name, path)
+            archived.append(path)
+            if not _lock():
+                break #lost with the commit, someone else takes over
+        db.session.rollback()
+        return archived
+
+def start_partition_thread(app, interval, months_ahead=MONTHS_AHEAD, archive_dir=None, archive_after_months=ARCHIVE_AFTER_MONTHS,
+                           archive_format="ndjson"):
+    #runs once straight away (a fresh database has no partitions), then every interval seconds
+    stop = threading.Event()
+
+    def run():
+        while True:
+            try:
+                ensure_partitions(app, months_ahead)
+                if archive_dir:
+                    archive_partitions(app, archive_dir, archive_after_months, archive_format)
+            except Exception as e:
+                app.logger.error(f"Error maintaining query partitions: {e}")
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=run, name="query-partitions", daemon=True).start()
+    return stop
+
+if __name__ == "__main__":
+    #python partitions.py ensure | convert | archive DIRECTORY [--months N] [--format ndjson|parquet] [--drop]
+    import argparse
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of the queries table")
+    parser.add_argument("command", choices=["ensure", "convert", "archive"])
+    parser.add_argument("directory", nargs="?", help="archive directory")
+    parser.add_argument("--months", type=int, default=ARCHIVE_AFTER_MONTHS, help="archive partitions older than this many months")
+    parser.add_argument("--format", choices=ARCHIVE_FORMATS, default="ndjson")
+    parser.add_argument("--drop", action="store_true", help="drop partitions after detaching them")
+    args = parser.parse_args()
+
+    from app import app
+    if args.command == "ensure":
+        print(f"Created {ensure_partitions(app) or 'no'} partitions")
+    elif args.command == "convert":
+        moved = convert_to_partitioned(app)
+        print("queries is already partitioned" if moved is False else f"Moved {moved} rows into the partitioned table")
+    else:
+        if not args.directory:
+            parser.error("archive needs a directory")
+        for path in archive_partitions(app, args.directory, args.months, args.format, args.drop):
+            print(f"Archived {path}")
@@ -0,0 +1,186 @@
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import func, insert, text
+from models import db, Query
+
+#/ask logs its Query row through this module, so the answer never waits on a database commit
+
+BATCH_SIZE = 100 #rows per multi-row insert
+FLUSH_MS = 200 #a partial batch is written after this long
+QUEUE_SIZE = 10000 #rows buffered before backpressure kicks in
+PUT_TIMEOUT = 0.05 #seconds a request waits for queue space before its row is dropped
+ID_BLOCK = 100 #ids reserved from the sequence per round trip
+MAX_FLUSH_ATTEMPTS = 3 #a batch that keeps failing is dropped after this many tries
+
+class IdAllocator:
+    """Hands out queries.id values from blocks reserved in one round trip, so a row's id is known before it is written."""
+
+    def __init__(self, app, block_size=ID_BLOCK):
+        self.app = app
+        self.block_size = block_size
+        self._ids = deque()
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        with self.app.app_context():
+            if db.engine.dialect.name == "postgresql":
+                rows = db.session.execute(
+                    text("SELECT nextval('queries_id_seq') FROM generate_series(1, :n)"),
+                    {"n": self.block_size},
+                )
+                ids = [row[0] for row in rows]
+            else:
+                #no sequences (sqlite in development): continue after the highest id, single process only
+                start = max(db.session.query(func.max(Query.id)).scalar() or 0, self._last) + 1
+                ids = list(range(start, start + self.block_size))
+            db.session.commit()
+        self._last = ids[-1]
+        return ids
+
+    def next(self):
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(self._reserve())
+            return self._ids.popleft()
+
+class _Flush:
+    #queue marker: write everything queued before it, then set done
+    def __init__(self):
+        self.done = threading.Event()
+
+class QueryLogWriter:
+    """Buffers Query rows in a bounded queue and writes them with multi-row inserts from one background thread."""
+
+    def __init__(self, app, batch_size=BATCH_SIZE, flush_ms=FLUSH_MS, queue_size=QUEUE_SIZE, id_block=ID_BLOCK):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.ids = IdAllocator(app, id_block)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = set() #ids submitted but not written yet
+        self._pending_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, **values):
+        #returns the row's id straight away; the row itself is written by the background thread
+        values["id"] = self.ids.next()
+        values.setdefault("asked_at", datetime.now(timezone.utc))
+        with self._pending_lock:
+            self._pending.add(values["id"])
+        try:
+            #a short wait when the database falls behind, then drop rather than stall the answer
+            self._queue.put(values, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            self._drop([values])
+        return values["id"]
+
+    def is_pending(self, query_id):
+        try:
+            query_id = int(query_id)
+        except (TypeError, ValueError):
+            return False
+        with self._pending_lock:
+            return query_id in self._pending
+
+    def flush(self, timeout=5):
+        #blocks until everything submitted so far is written (or dropped)
+        marker = _Flush()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def close(self):
+        #durable shutdown: stop the thread once it has written what is still queued
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=30)
+
+    def _drop(self, rows):
+        with self._pending_lock:
+            for row in rows:
+                self._pending.discard(row["id"])
+            self.dropped += len(rows)
+            dropped = self.dropped
+        self.app.logger.warning("query log dropped %s rows (%s in total)", len(rows), dropped)
+
+    def _run(self):
+        while True:
+            batch, markers, stop = self._collect()
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.done.set()
+            if stop:
+                return
+
+    def _collect(self):
+        #rows until the batch is full or flush_ms after the first one arrived; idle workers just block here
+        batch = []
+        markers = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.flush_seconds
+        while True:
+            if item is None:
+                #close(): take everything still queued, then stop
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        return batch, markers, True
+                    if isinstance(item, _Flush):
+                        markers.append(item)
+                    elif item is not None:
+                        batch.append(item)
+            if isinstance(item, _Flush):
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                return batch, markers, False
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return batch, markers, False
+
+    def _write(self, rows):
+        for attempt in range(MAX_FLUSH_ATTEMPTS):
+            try:
+                with self.app.app_context():
+                    #one INSERT ... VALUES (...), (...) statement per batch
+                    db.session.execute(insert(Query), rows)
+                    db.session.commit()
+            except Exception as e:
+                self.failed_flushes += 1
+                self.app.logger.error(f"Error writing query log batch: {e}")
+                if attempt + 1 < MAX_FLUSH_ATTEMPTS:
+                    time.sleep(0.5 * 2 ** attempt)
+                continue
+            with self._pending_lock:
+                for row in rows:
+                    self._pending.discard(row["id"])
+                self.written += len(rows)
+            return
+        self._drop(rows)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+        }
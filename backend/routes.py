@@ -1,37 +1,85 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
-from werkzeug.utils import secure_filename
+from flask import Blueprint, request, jsonify, current_app, send_file, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from models import db, Query  , CVUpload
+from db import pool_stats
+from sqlalchemy import column, text, update, values
+from analytics import hourly_rollups
+from datetime import datetime, timedelta, timezone
 from chatbot.chatbot import PerplexityChatbot
+from chatbot.cache import AnswerCache
+from chatbot.memory import create_session_store
+from chatbot.classifier import load_classifier
 from scholarship_finder.scholarship import build_prompt as scholarship_prompt, fetch_scholarships
 from sop_builder.sop_builder import generate_sop, save_pdf, save_docx
 from cv_builder.save import save_as_docx  
-from cv_builder.parse_cv import extract_info_from_pdf, extract_info_from_docx, extract_json_object
+from cv_builder.parse_cv import extract_text_from_pdf, extract_text_from_docx, parse_cv_text, file_hash, text_hash, TooManyPages
 from cv_builder.prompt_builder import build_prompt_CV as cv_prompt
 from cv_builder.generate_cv import call_perplexity
 from flasgger import swag_from
-import requests
+import llm_client
+from query_log import QueryLogWriter
+from llm_json import JSONExtractionError, NoJSONFound
 import time
 import json
 import tempfile
 import os
-import re
+import threading
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
 bot = None
+_bot_lock = threading.Lock()
+query_log = None
 
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@bp.before_app_request
-def create_chatbot():
+def get_chatbot():
+    #created lazily on the first /ask and reused by every later request
     global bot
-    bot = PerplexityChatbot(
-        api_key=current_app.config.get('CHATBOT_API_KEY'),
-        content_file_path=current_app.config.get('CONTENT_FILE')
-    )
+    if bot is None:
+        with _bot_lock:
+            if bot is None:
+                bot = PerplexityChatbot(
+                    api_key=current_app.config.get('CHATBOT_API_KEY'),
+                    content_file_path=current_app.config.get('CONTENT_FILE'),
+                    answer_cache=AnswerCache(
+                        max_entries=current_app.config.get('ANSWER_CACHE_SIZE'),
+                        ttl_seconds=current_app.config.get('ANSWER_CACHE_TTL'),
+                        threshold=current_app.config.get('ANSWER_CACHE_THRESHOLD'),
+                    ),
+                    session_store=create_session_store(
+                        kind=current_app.config.get('SESSION_STORE'),
+                        max_sessions=current_app.config.get('SESSION_MAX_ENTRIES'),
+                        ttl_seconds=current_app.config.get('SESSION_TTL'),
+                        app=current_app._get_current_object(),
+                    ),
+                    prompt_token_budget=current_app.config.get('PROMPT_TOKEN_BUDGET'),
+                    classifier=load_classifier(
+                        model_path=current_app.config.get('CLASSIFIER_MODEL'),
+                        threshold=current_app.config.get('CLASSIFIER_THRESHOLD'),
+                    ),
+                    faq_threshold=current_app.config.get('FAQ_THRESHOLD'),
+                    reload_interval=current_app.config.get('CONTENT_RELOAD_INTERVAL')
+                )
+    return bot
+
+def get_query_log():
+    #one background writer per worker process, started on the first logged question
+    global query_log
+    if query_log is None:
+        with _bot_lock:
+            if query_log is None:
+                query_log = QueryLogWriter(
+                    current_app._get_current_object(),
+                    batch_size=current_app.config.get('QUERY_LOG_BATCH_SIZE'),
+                    flush_ms=current_app.config.get('QUERY_LOG_FLUSH_MS'),
+                    queue_size=current_app.config.get('QUERY_LOG_QUEUE_SIZE'),
+                    id_block=current_app.config.get('QUERY_LOG_ID_BLOCK'),
+                )
+    return query_log
 
 # @bp.after_request
 # def add_cors_headers(response):
@@ -41,6 +89,21 @@ def create_chatbot():
 #     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
 #     return response
 
+def _save_query(question, session_id, user_id, result, latency_ms, ip, ua):
+    #queued for a batched insert, the id is reserved up front so it can be returned as messageId right away
+    return get_query_log().submit(
+        session_id=session_id,
+        user_id=user_id,
+        question=question,
+        answer=result["answer"],
+        model=result.get("source", "perplexity-sonar"),
+        latency_ms=latency_ms,
+        success=True,
+        ip_address=ip,
+        user_agent=ua,
+        prompt_tokens=result.get("prompt_tokens"), #estimated prompt size per section, to see where prompt cost comes from
+    )
+
 @bp.route('/ask', methods=['POST'])
 @swag_from('specs/api_spec.yaml', endpoint='api.ask')
 def ask():
@@ -57,29 +120,15 @@ def ask():
     ua = request.headers.get("User-Agent")
 
     try:
-        raw_answer = bot.ask_question(question, session_id)
+        raw_answer = get_chatbot().ask_question(question, session_id)
         latency_ms = int((time.time() - start) * 1000)
-
-        query = Query(
-            session_id=session_id,
-            user_id=user_id,
-            question=question,
-            answer=raw_answer["answer"],
-            model="perplexity-sonar",
-            latency_ms=latency_ms,
-            success=True,
-            ip_address=ip,
-            user_agent=ua,
-        )
-
-        db.session.add(query)
-        db.session.commit()
+        message_id = _save_query(question, session_id, user_id, raw_answer, latency_ms, ip, ua)
 
         return jsonify({
             "answer": raw_answer["answer"],
             "links": raw_answer["links"],
             "latencyMs": latency_ms,
-            "messageId": query.id
+            "messageId": message_id
         })
 
     except Exception as e:
@@ -87,43 +136,213 @@ def ask():
         current_app.logger.error(f"Error during ask: {e}")
         return jsonify({"error": f"Failed to get answer: {str(e)}"}), 500
 
-@bp.route('/feedback', methods=['POST'])
-@swag_from('specs/api_spec.yaml', endpoint='api.feedback')
-def feedback():
-    data = request.get_json()
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/ask/stream', methods=['POST'])
+@swag_from('specs/api_spec.yaml', endpoint='api.ask_stream')
+def ask_stream():
+    start = time.time()
+    data = request.get_json(silent=True) or {}
+    question = (data.get("question") or "").strip()
+    session_id = data.get("sessionId")
+    user_id = data.get("userId")
+
+    if not question:
+        return jsonify({"error": "Question is required"}), 400
+
+    ip = request.headers.get("X-Forwarded-For", request.remote_addr)
+    ua = request.headers.get("User-Agent")
+    chatbot = get_chatbot()
+
+    def generate():
+        #answer text is relayed as "token" events, links and messageId arrive in the final "done" event
+        try:
+            for event, payload in chatbot.ask_question_stream(question, session_id):
+                if event == "token":
+                    yield _sse("token", {"text": payload})
+                    continue
+                latency_ms = int((time.time() - start) * 1000)
+                message_id = _save_query(question, session_id, user_id, payload, latency_ms, ip, ua)
+                yield _sse("done", {
+                    "answer": payload["answer"],
+                    "links": payload["links"],
+                    "latencyMs": latency_ms,
+                    "messageId": message_id
+                })
+        except Exception as e:
+            current_app.logger.error(f"Error during ask stream: {e}")
+            yield _sse("error", {"error": f"Failed to get answer: {str(e)}"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+FEEDBACK_BATCH_MAX = 500 #items per /feedback/batch request
+
+FEEDBACK_RETRY_INTERVAL = 0.2 #seconds between updates for ids whose row another worker may not have written yet
+
+def _apply_feedback(items):
+    #one UPDATE ... RETURNING for the items, returns the ids that exist; rows are never loaded
+    if len(items) == 1 or db.engine.dialect.name != "postgresql":
+        #sqlite cannot UPDATE ... FROM (VALUES ...), one UPDATE ... RETURNING per item in a single transaction
+        updated = set()
+        for message_id, (thumbs_up, thumbs_down, feedback_text) in items.items():
+            row = db.session.execute(
+                update(Query)
+                .where(Query.id == message_id)
+                .values(thumbs_up=thumbs_up, thumbs_down=thumbs_down, feedback=feedback_text)
+                .returning(Query.id)
+            ).first()
+            if row is not None:
+                updated.add(row[0])
+        return updated
+    rows = values(
+        column("id", db.BigInteger), column("thumbs_up", db.Boolean), column("thumbs_down", db.Boolean), column("feedback", db.Text),
+        name="feedback_items",
+    ).data([(message_id, *item) for message_id, item in items.items()])
+    return {row[0] for row in db.session.execute(
+        update(Query)
+        .where(Query.id == rows.c.id)
+        .values(thumbs_up=rows.c.thumbs_up, thumbs_down=rows.c.thumbs_down, feedback=rows.c.feedback)
+        .returning(Query.id)
+    )}
+
+def _allocated(message_ids):
+    #ids the sequence has handed out: their row may still sit in another gunicorn worker's query log
+    if db.engine.dialect.name != "postgresql":
+        return set() #sqlite in development is a single process, the flush below covers it
+    last = db.session.execute(text("SELECT last_value FROM queries_id_seq")).scalar()
+    return {message_id for message_id in message_ids if message_id <= last}
+
+def _update_feedback(items):
+    #items: {message_id: (thumbs_up, thumbs_down, feedback)}; returns the ids that exist
+    if query_log is not None and any(query_log.is_pending(message_id) for message_id in items):
+        query_log.flush() #feedback arrived before the row's batch was written
+
+    updated = _apply_feedback(items)
+    missing = _allocated(set(items) - updated)
+    db.session.commit()
+
+    #the local flush only sees this worker's writer: ids handed out elsewhere are retried for a short while
+    #before they count as not found, long enough for another worker's flush and its retries
+    deadline = time.monotonic() + current_app.config.get('FEEDBACK_RETRY_MS', 2000) / 1000
+    while missing and time.monotonic() < deadline:
+        time.sleep(FEEDBACK_RETRY_INTERVAL)
+        found = _apply_feedback({message_id: items[message_id] for message_id in missing})
+        db.session.commit()
+        updated |= found
+        missing -= found
+    return updated
+
+def _feedback_item(data):
+    #(message_id, (thumbs_up, thumbs_down, feedback)) from a request item, raises ValueError with the 400 message if invalid
+    if not isinstance(data, dict):
+        raise ValueError("Feedback items must be objects")
     message_id = data.get("messageId")
+    if not message_id:
+        raise ValueError("Message ID is required")
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        raise ValueError("Message ID must be a number") from None
+    #real JSON booleans only, bool("false") would record the opposite of what the client meant
     thumbs_up = data.get("thumbsUp", False)
     thumbs_down = data.get("thumbsDown", False)
-    feedback_text = data.get("feedback", "")
+    if not isinstance(thumbs_up, bool) or not isinstance(thumbs_down, bool):
+        raise ValueError("thumbsUp and thumbsDown must be true or false")
+    feedback_text = data.get("feedback") or ""
+    if not isinstance(feedback_text, str):
+        raise ValueError("feedback must be a string")
+    return message_id, (thumbs_up, thumbs_down, feedback_text)
 
-    if not message_id:
-        return jsonify({"error": "Message ID is required"}), 400
+@bp.route('/feedback', methods=['POST'])
+@swag_from('specs/api_spec.yaml', endpoint='api.feedback')
+def feedback():
+    data = request.get_json(silent=True) or {}
+    try:
+        message_id, item = _feedback_item(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        query = Query.query.get(message_id)
-        if not query:
+        if not _update_feedback({message_id: item}):
             return jsonify({"error": "Message ID not found"}), 404
+        return jsonify({"status": "ok"})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating feedback: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        query.thumbs_up = thumbs_up
-        query.thumbs_down = thumbs_down
-        query.feedback = feedback_text
+@bp.route('/feedback/batch', methods=['POST'])
+@swag_from('specs/api_spec.yaml', endpoint='api.feedback_batch')
+def feedback_batch():
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > FEEDBACK_BATCH_MAX:
+        return jsonify({"error": f"At most {FEEDBACK_BATCH_MAX} items per request"}), 400
 
-        db.session.commit()
+    try:
+        #a later item for the same message wins, like repeated single calls would
+        parsed = dict(_feedback_item(item) for item in items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        return jsonify({"status": "ok"})
+    try:
+        updated = _update_feedback(parsed)
+        return jsonify({
+            "status": "ok",
+            "updated": sorted(updated),
+            "notFound": sorted(set(parsed) - updated),
+        })
     except Exception as e:
-        current_app.logger.error(f"Error updating feedback: {e}")
+        db.session.rollback()
+        current_app.logger.error(f"Error updating feedback batch: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _parse_time(value):
+    #ISO 8601, "Z" suffix allowed, naive timestamps are taken as UTC
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+@bp.route('/analytics/hourly', methods=['GET'])
+@swag_from('specs/api_spec.yaml', endpoint='api.hourly_analytics')
+def hourly_analytics():
+    #served from the rollup table only, never from queries
+    try:
+        end = _parse_time(request.args["to"]) if request.args.get("to") else datetime.now(timezone.utc)
+        start = _parse_time(request.args["from"]) if request.args.get("from") else end - timedelta(hours=24)
+    except ValueError:
+        return jsonify({"error": "from and to must be ISO 8601 timestamps"}), 400
+
+    try:
+        return jsonify({"hours": hourly_rollups(start, end)})
+    except Exception as e:
+        current_app.logger.error(f"Error reading hourly analytics: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/metrics/db', methods=['GET'])
+@swag_from('specs/api_spec.yaml', endpoint='api.db_metrics')
+def db_metrics():
+    #connection pool and query log state of this worker, to tell database waits apart from LLM latency
+    return jsonify({
+        "pool": pool_stats(),
+        "queryLog": query_log.stats() if query_log is not None else None,
+    })
+
 @bp.route("/transcribe")
 @swag_from('specs/api_spec.yaml', endpoint='api.transcribe')
 def transcribe():
     try:
         audio_file = request.files["file"]
-        response = requests.post(
-            "https://api.perplexity.ai/audio/transcriptions",
-            headers={"Authorization": f"Bearer {current_app.config.get('CHATBOT_API_KEY')}"},
-            files={"file": (audio_file.filename, audio_file, audio_file.mimetype)},
+        response = llm_client.transcribe(
+            current_app.config.get('CHATBOT_API_KEY'),
+            #read into memory so a retried attempt can resend the same bytes
+            files={"file": (audio_file.filename, audio_file.read(), audio_file.mimetype)},
         )
         return jsonify(response.json())
     except Exception as e:
@@ -409,13 +628,30 @@ def _extract_user_data(data, workflow):
     else:
         raise ValueError("Invalid workflow")
     
+def _previous_cv(hash_column, digest):
+    #parsed json of the latest earlier upload with this hash, None if there is none
+    row = (
+        CVUpload.query
+        .with_entities(CVUpload.json_response)
+        .filter(hash_column == digest)
+        .order_by(CVUpload.id.desc())
+        .first()
+    )
+    return row.json_response if row else None
+
 @bp.route('/upload-cv', methods=['POST'])
 @swag_from('specs/api_spec.yaml', endpoint='api.upload_cv')
 def upload_cv():
-    if 'file' not in request.files:
+    #enforced while the body is read, the upload is never buffered past the limit
+    request.max_content_length = current_app.config['CV_UPLOAD_MAX_BYTES']
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return jsonify({"error": "File is too large"}), 413
+    if 'file' not in files:
         return jsonify({"error": "No file part"}), 400
 
-    file = request.files['file']
+    file = files['file']
     session_id = request.form.get("session_id")
     user_id = request.form.get("user_id")
 
@@ -425,33 +661,43 @@ def upload_cv():
     if not allowed_file(file.filename):
         return jsonify({"error": "Unsupported file type"}), 400
 
-    filename = secure_filename(file.filename)
-    upload_folder = current_app.config.get('UPLOAD_FOLDER', '/tmp/uploads')
-    os.makedirs(upload_folder, exist_ok=True)
-    file_path = os.path.join(upload_folder, filename)
-    file.save(file_path)
-
-    if filename.endswith('.pdf'):
-        info = extract_info_from_pdf(file_path)
-    else:
-        info = extract_info_from_docx(file_path)
-
-    # print("Before cleanup\n" + info)
-
-    info_clean = info.strip()
-    info_clean = re.sub(r'^`{3}', '', info_clean)
-    info_clean = re.sub(r'`{3}$', '', info_clean)
-    info_clean = info_clean.strip()
-
-    # print("After cleanup\n" + info_clean)
-
-    if not (info_clean.startswith('{') and info_clean.endswith('}')):
-        current_app.logger.error("Parsed file info does not start and end with curly braces: %r", info_clean)
-        return jsonify({"error": "Invalid JSON output from file parsing."}), 422
+    #force=true parses the file again even if the same cv was uploaded before
+    force = (request.form.get("force") or request.args.get("force") or "").lower() in ("1", "true", "yes")
+
+    #parsed straight from the upload stream (in memory, or a temp file above UPLOAD_SPOOL_BYTES), nothing is saved
+    file_sha256 = file_hash(file.stream)
+    text_sha256 = None
+    data = None if force else _previous_cv(CVUpload.file_sha256, file_sha256)
+    if data is None:
+        try:
+            if file.filename.lower().endswith('.pdf'):
+                text = extract_text_from_pdf(
+                    file.stream,
+                    current_app.config['CV_UPLOAD_MAX_PAGES'],
+                    current_app.config['PDF_ENGINE'],
+                    current_app.config['PDF_PARALLEL_PAGES'],
+                )
+            else:
+                text = extract_text_from_docx(file.stream)
+        except TooManyPages as e:
+            return jsonify({"error": str(e)}), 413
+        text_sha256 = text_hash(text)
+        if not force and text_sha256:
+            data = _previous_cv(CVUpload.text_sha256, text_sha256)
+        if data is None:
+            try:
+                data = parse_cv_text(text)
+            except NoJSONFound as e:
+                current_app.logger.error("Parsed file info contains no JSON object: %s", e)
+                return jsonify({"error": "Invalid JSON output from file parsing."}), 422
+            except JSONExtractionError as e:
+                current_app.logger.error(f"Error parsing file info as JSON: {e}")
+                return jsonify({"error": "File info could not be parsed as JSON."}), 422
 
     try:
-        data = json.loads(info_clean)
-        cv_upload = CVUpload(session_id=session_id, user_id=user_id, json_response=data)
+        #a reused parse still gets its own row, so the session and user keep a record of the upload
+        cv_upload = CVUpload(session_id=session_id, user_id=user_id, json_response=data,
+                             file_sha256=file_sha256, text_sha256=text_sha256)
         db.session.add(cv_upload)
         db.session.commit()
     except Exception as e:
@@ -1,33 +1,6 @@
 import requests
-import json
-import re
-
-def extract_json_object(text):
-    if not text:
-        return None
-    
-    #remove markdown code blocks
-    text = re.sub(r'^```(?:json)?\s*', '', text.strip())
-    text = re.sub(r'```\s*$', '', text.strip())
-    
-    #find the first { and last }
-    start = text.find('{')
-    end = text.rfind('}')
-    
-    if start == -1 or end == -1:
-        return None
-    
-    return text[start:end+1]
-
-def clean_json(text):
-
-    if not text:
-        return text
-    
-    # Remove trailing commas before closing braces/brackets
-    text = re.sub(r',(\s*[}\]])', r'\1', text)
-    
-    return text.strip()
+import llm_client
+from llm_json import MalformedJSON, NoJSONFound, UnexpectedJSON, parse_json_object
 
 def get_user_details():
     print("Please enter your details below.")
@@ -128,11 +101,6 @@ Ensure the JSON you return is syntactically valid and parseable.
 
 def fetch_scholarships(prompt):
     from flask import current_app
-    url = "https://api.perplexity.ai/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {current_app.config.get("SCHOLARSHIP_FINDER_API_KEY")}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "model": "sonar",
         "messages": [{"role": "user", "content": prompt}],
@@ -141,7 +109,7 @@ def fetch_scholarships(prompt):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = llm_client.coalesced_chat_completion(current_app.config.get("SCHOLARSHIP_FINDER_API_KEY"), payload)
         response.raise_for_status()
         content = response.json()["choices"][0]["message"]["content"]
 
@@ -153,26 +121,19 @@ def fetch_scholarships(prompt):
                 "error": "Something went wrong. Please try again."
             }
         
-        extracted = extract_json_object(content) #extract json object
-
-        #if no json object extracted from perplexity
-        if not extracted:
+        try:
+            parsed = parse_json_object(content, required=("scholarships",))
+        except NoJSONFound: #if no json object extracted from perplexity
             return {
                 "scholarships": [],
                 "error": "Something went wrong. Please try again shortly."
             }
-        
-        cleaned = clean_json(extracted)
-
-        try:
-            parsed = json.loads(cleaned)
-        except json.JSONDecodeError: #invalid json
+        except MalformedJSON: #invalid json
             return {
                 "scholarships": [],
                 "error": "We ran into an issue while finding scholarships. Please try again shortly."
             }
-        
-        if not isinstance(parsed, dict) or "scholarships" not in parsed: #to handle random structure in json
+        except UnexpectedJSON: #to handle random structure in json
             return {
                 "scholarships": [],
                 "error": "We couldn’t find valid scholarships for your profile. Please try again."
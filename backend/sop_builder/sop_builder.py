@@ -1,5 +1,6 @@
-import json
 import requests  # for perplexity
+import llm_client
+from llm_json import JSONExtractionError, extract_json_object
 from fpdf import FPDF  # to download sop as pdf
 from docx import Document  # to download sop as doc
 import re
@@ -71,18 +72,20 @@ def determine_intended_degree(academic_text):
     else:
         return "Masters"
 
-def extract_text_from_docx(filepath):
+# source is a path or a binary file object (e.g. an upload kept in memory)
+def extract_text_from_docx(source):
     try:
-        doc = Document(filepath)
+        doc = Document(source)
         return "\n".join([para.text for para in doc.paragraphs])
     except Exception:
         return ""
 
-def extract_text_from_pdf(filepath):
+# only the first max_pages pages are read
+def extract_text_from_pdf(source, max_pages=None):
     try:
-        with open(filepath, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
+        reader = PyPDF2.PdfReader(source)
+        pages = reader.pages if max_pages is None else reader.pages[:max_pages]
+        return "\n".join(text for text in (page.extract_text() for page in pages) if text)
     except Exception:
         return ""
 
@@ -226,7 +229,6 @@ def save_docx(filename, content):
     doc.save(filename)
 
 def call_perplexity_api(prompt, token):
-    url = "https://api.perplexity.ai/chat/completions"
     payload = {
         "model": "sonar",
         "messages": [{"role": "user", "content": prompt}],
@@ -250,12 +252,8 @@ def call_perplexity_api(prompt, token):
             }
         }
     }
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = llm_client.coalesced_chat_completion(token, payload, endpoint="generation")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException:
@@ -278,10 +276,10 @@ def generate_sop(user_inputs, token):
         raise ValueError("Blank SOP response")
 
     try:
-        data = json.loads(content)
-        sop = data.get("sop", "").strip()
-    except (json.JSONDecodeError, KeyError):
-        sop = content.strip()
+        data = extract_json_object(content)
+        sop = str(data.get("sop") or "").strip()
+    except JSONExtractionError:
+        sop = content.strip() #plain text reply, used as the sop itself
 
     if not sop:
         raise ValueError("Blank SOP response")
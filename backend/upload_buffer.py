@@ -0,0 +1,13 @@
+import tempfile
+from flask import Request, current_app
+
+#uploaded files are parsed from memory: small ones never touch the disk, large ones spill to an anonymous temp file
+
+SPOOL_BYTES = 1024 * 1024 #uploads up to this size stay in memory
+
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory up to UPLOAD_SPOOL_BYTES, then rolls them over to a unique temp file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        #werkzeug spools at a fixed 500KB; the temp file is unnamed and deleted when the upload is closed
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config.get("UPLOAD_SPOOL_BYTES", SPOOL_BYTES), mode="rb+")